@@ -5,6 +5,8 @@ Glue ETL script for processing cryptocurrency transaction data
 import sys
 from awsglue.transforms import *
 from awsglue.utils import getResolvedOptions
+from pyspark import StorageLevel
+from pyspark.conf import SparkConf
 from pyspark.context import SparkContext
 from awsglue.context import GlueContext
 from awsglue.job import Job
@@ -13,77 +15,214 @@ from pyspark.sql.types import *
 import boto3
 
 # Get job parameters
-args = getResolvedOptions(sys.argv, ['JOB_NAME', 'input_path', 'output_bucket'])
+args = getResolvedOptions(sys.argv, ['JOB_NAME', 'input_paths', 'output_bucket'])
+
+# Optional Neptune endpoint for the graph update, passed by the ETL trigger
+neptune_endpoint = None
+if '--neptune_endpoint' in sys.argv:
+    neptune_endpoint = getResolvedOptions(sys.argv, ['neptune_endpoint'])['neptune_endpoint']
+
+# Number of transactions written to Neptune per traversal
+NEPTUNE_BATCH_SIZE = 200
+
+# Compression and codegen settings; core Spark settings cannot be changed
+# once the context exists, so they are applied when it is created
+spark_conf = SparkConf().setAll([
+    ("spark.shuffle.compress", "true"),
+    ("spark.shuffle.spill.compress", "true"),
+    ("spark.rdd.compress", "true"),
+    ("spark.sql.codegen.aggregate.map.twolevel.enabled", "true"),
+    ("spark.sql.inMemoryColumnarStorage.compressed", "true")
+])
 
 # Initialize Glue context
-sc = SparkContext()
+sc = SparkContext(conf=spark_conf)
 glueContext = GlueContext(sc)
 spark = glueContext.spark_session
 job = Job(glueContext)
 job.init(args['JOB_NAME'], args)
 
+# Size shuffles to the executor cores instead of the default 200 partitions
+spark.conf.set("spark.sql.shuffle.partitions", str(sc.defaultParallelism))
+
+# Pack many small raw objects into fewer input partitions
+spark.conf.set("spark.sql.files.maxPartitionBytes", "134217728")
+
+# Push filters down into the Parquet readers
+spark.conf.set("spark.sql.parquet.filterPushdown", "true")
+
+# Let adaptive execution size and split the currency partitions on write
+spark.conf.set("spark.sql.adaptive.enabled", "true")
+spark.conf.set("spark.sql.adaptive.optimizeSkewsInRebalancePartitions.enabled", "true")
+spark.conf.set("spark.sql.adaptive.advisoryPartitionSizeInBytes", "128m")
+
+# Raw transactions are partitioned by currency and date under this prefix
+RAW_PREFIX = "raw-transactions/"
+
+def address_type(column):
+    """Classify an address column by prefix as a SQL expression, matching data ingestion"""
+    return F.expr(
+        f"CASE WHEN substr({column}, 1, 1) = '1' THEN 'P2PKH' "
+        f"WHEN substr({column}, 1, 1) = '3' THEN 'P2SH' "
+        f"WHEN substr({column}, 1, 3) = 'bc1' THEN 'BECH32' "
+        f"WHEN substr({column}, 1, 2) = '0x' THEN 'ETH' "
+        "ELSE 'UNKNOWN' END"
+    ).alias(f"{column}_type")
+
 def process_transactions():
     """Main ETL processing function"""
     
-    # Read transaction data from S3
-    input_path = f"s3://{args['input_path']}"
+    # Read every queued batch from S3 in one pass
+    input_paths = [f"s3://{path}" for path in args['input_paths'].split(',') if path]
     
-    # Create dynamic frame from S3
-    transactions_df = glueContext.create_dynamic_frame.from_options(
-        connection_type="s3",
-        connection_options={
-            "paths": [input_path],
-            "recurse": True
-        },
-        format="json"
-    ).toDF()
+    # Read the columnar raw objects; basePath restores the currency and date
+    # partition columns from the object paths
+    base_path = f"s3://{args['input_paths'].split('/', 1)[0]}/{RAW_PREFIX}"
+    transactions_df = spark.read.option("basePath", base_path).parquet(*input_paths)
     
-    # Data transformations
+    # Data transformations and derived features in a single projection
     processed_df = transactions_df.select(
         F.col("id").alias("transaction_id"),
         F.col("from_address"),
         F.col("to_address"),
-        F.col("amount").cast(DoubleType()),
-        F.col("timestamp").cast(LongType()),
+        address_type("from_address"),
+        address_type("to_address"),
+        F.col("amount"),
+        F.col("timestamp"),
         F.col("currency"),
-        F.col("amount_usd").cast(DoubleType()),
+        F.col("amount_usd"),
         F.col("size_category"),
-        F.col("hour_of_day").cast(IntegerType()),
-        F.col("day_of_week").cast(IntegerType())
+        F.col("hour_of_day"),
+        F.col("day_of_week"),
+        F.log10(F.col("amount") + 1).alias("log_amount"),
+        F.when(F.col("day_of_week").isin([5, 6]), 1).otherwise(0).alias("is_weekend"),
+        F.when((F.col("hour_of_day") >= 22) | (F.col("hour_of_day") <= 6), 1).otherwise(0).alias("is_night")
     )
     
-    # Add derived features
-    processed_df = processed_df.withColumn(
-        "log_amount", F.log10(F.col("amount") + 1)
-    ).withColumn(
-        "is_weekend", F.when(F.col("day_of_week").isin([5, 6]), 1).otherwise(0)
-    ).withColumn(
-        "is_night", F.when(F.col("hour_of_day").between(22, 6), 1).otherwise(0)
-    )
+    # Both the S3 write and the Neptune update read the processed rows, so
+    # they are computed once and kept for the second action
+    processed_df.persist(StorageLevel.MEMORY_AND_DISK)
     
     # Write processed data back to S3
     output_path = f"s3://{args['output_bucket']}/processed-transactions/"
     
-    processed_df.write.mode("append").partitionBy("currency").parquet(output_path)
-    
-    # Update Neptune with transaction graph
-    update_neptune_graph(processed_df)
+    try:
+        # Cluster rows by currency first so each output partition is written by
+        # as few tasks as possible; AQE splits skewed currencies and merges small ones
+        processed_df.hint("rebalance", "currency").write.mode("append").partitionBy("currency").parquet(output_path)
+        
+        # Update Neptune with transaction graph
+        update_neptune_graph(processed_df)
+    finally:
+        processed_df.unpersist()
     
-    print(f"Processed {processed_df.count()} transactions")
+    print(f"Processed transactions written to {output_path}")
 
 def update_neptune_graph(df):
     """Update Neptune graph with transaction data"""
+    if not neptune_endpoint:
+        print("No Neptune endpoint configured, skipping graph update")
+        return
+    
     try:
-        # Collect small sample for Neptune update
-        sample_transactions = df.limit(100).collect()
+        # Executors sign their connections for the cluster's IAM authentication
+        region = boto3.session.Session().region_name
+        
+        # Upsert each address from exactly one partition first, so concurrent
+        # partitions never race to create the same vertex
+        addresses = (
+            df.select(F.col("from_address").alias("address"))
+            .union(df.select(F.col("to_address").alias("address")))
+            .distinct()
+            .repartition("address")
+        )
+        addresses.rdd.mapPartitions(
+            lambda rows: write_partition_to_neptune(neptune_endpoint, region, rows, write_addresses_to_neptune)
+        ).sum()
+        
+        # Then add the transfers; a transaction repeated in the input lands in
+        # a single partition, and one already in the graph is left as is
+        transfers = df.select(
+            "transaction_id", "from_address", "to_address", "amount", "timestamp"
+        ).dropDuplicates(["transaction_id"])
+        written = transfers.rdd.mapPartitions(
+            lambda rows: write_partition_to_neptune(neptune_endpoint, region, rows, write_transfers_to_neptune)
+        ).sum()
         
-        # Here you would connect to Neptune and update the graph
-        # For now, just log the operation
-        print(f"Would update Neptune with {len(sample_transactions)} transactions")
+        print(f"Updated Neptune with {written} transactions")
         
     except Exception as e:
         print(f"Error updating Neptune: {str(e)}")
 
+def connect_to_neptune(endpoint, region):
+    """Open a Gremlin connection signed with SigV4 using the job role's credentials"""
+    # Imported on the executors; requires gremlinpython in --additional-python-modules
+    from botocore.auth import SigV4Auth
+    from botocore.awsrequest import AWSRequest
+    from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
+    
+    url = f'wss://{endpoint}:8182/gremlin'
+    request = AWSRequest(method='GET', url=f'https://{endpoint}:8182/gremlin')
+    SigV4Auth(boto3.session.Session().get_credentials(), 'neptune-db', region).add_auth(request)
+    
+    return DriverRemoteConnection(url, 'g', headers=dict(request.headers.items()))
+
+def write_partition_to_neptune(endpoint, region, rows, write_batch):
+    """Write one partition to Neptune in batches with the given batch writer"""
+    from gremlin_python.process.anonymous_traversal import traversal
+    
+    connection = connect_to_neptune(endpoint, region)
+    g = traversal().withRemote(connection)
+    written = 0
+    
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= NEPTUNE_BATCH_SIZE:
+                written += write_batch(g, batch)
+                batch = []
+        
+        if batch:
+            written += write_batch(g, batch)
+    finally:
+        connection.close()
+    
+    yield written
+
+def write_addresses_to_neptune(g, batch):
+    """Upsert a batch of address vertices in one traversal"""
+    from gremlin_python.process.graph_traversal import __
+    
+    t = g.inject(0)
+    for row in batch:
+        t = t.coalesce(
+            __.V().hasLabel('address').has('address', row.address),
+            __.addV('address').property('address', row.address)
+        )
+    
+    t.iterate()
+    return len(batch)
+
+def write_transfers_to_neptune(g, batch):
+    """Add a transfer edge per transaction unless one with its ID exists, in one traversal"""
+    from gremlin_python.process.graph_traversal import __
+    
+    # Each upsert runs as a side effect, so the traverser reaches every row
+    t = g.inject(0)
+    for row in batch:
+        t = t.sideEffect(__.coalesce(
+            __.E().hasLabel('transfer').has('transaction_id', row.transaction_id),
+            __.V().hasLabel('address').has('address', row.from_address)
+            .addE('transfer').to(__.V().hasLabel('address').has('address', row.to_address))
+            .property('transaction_id', row.transaction_id)
+            .property('amount', row.amount)
+            .property('timestamp', row.timestamp)
+        ))
+    
+    t.iterate()
+    return len(batch)
+
 # Run the ETL process
 if __name__ == "__main__":
     process_transactions()
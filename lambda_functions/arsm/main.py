@@ -5,6 +5,8 @@ Implements graph-based behavioral analysis using Neptune
 
 import json
 import boto3
+from decimal import Decimal
+import numpy as np
 import os
 from gremlin_python.driver import client
 from gremlin_python.driver.driver_remote_connection import DriverRemoteConnection
@@ -12,19 +14,37 @@ from gremlin_python.process.anonymous_traversal import traversal
 from gremlin_python.process.graph_traversal import __
 from gremlin_python.process.strategies import *
 from gremlin_python.process.traversal import T, P, Operator
+import threading
 import time
 
 
+dynamodb = boto3.resource('dynamodb')
+metadata_table = dynamodb.Table(os.environ['METADATA_TABLE'])
+address_metrics_table = dynamodb.Table(os.environ['ADDRESS_METRICS_TABLE'])
+
+# Neptune connection cache, guarded by a lock
+_neptune_lock = threading.Lock()
+_neptune_connection = None
+_neptune_g = None
+
+# Per-query timeout for ARSM traversals
+QUERY_TIMEOUT_MS = 5000
+
+# Hop limits for the repeat() traversals
+MAX_PATH_HOPS = 6
+MAX_COMPONENT_HOPS = 4
+MAX_COMPONENT_SIZE = 10000
+
+# Weights for centrality, clustering, velocity, path length and component size risk
+GRAPH_RISK_WEIGHTS = np.array([0.3, 0.2, 0.25, 0.15, 0.1])
+
+
 def handler(event, context):
     """
     Main handler for ARSM
     Performs graph-based risk scoring
     """
     try:
-        # Initialize clients
-        dynamodb = boto3.resource('dynamodb')
-        metadata_table = dynamodb.Table(os.environ['METADATA_TABLE'])
-        
         # Extract transaction data
         transaction_data = event.get('transaction', {})
         transaction_id = transaction_data.get('id', 'unknown')
@@ -72,16 +92,37 @@ def handler(event, context):
 
 
 def connect_to_neptune(endpoint):
-    """Connect to Neptune using Gremlin"""
-    try:
-        # For production, use IAM authentication
-        connection = DriverRemoteConnection(f'wss://{endpoint}:8182/gremlin', 'g')
-        g = traversal().withRemote(connection)
-        return g
-    except Exception as e:
-        print(f"Failed to connect to Neptune: {str(e)}")
-        # Return mock traversal for testing
-        return None
+    """Connect to Neptune using Gremlin, reusing the cached connection if any"""
+    global _neptune_connection, _neptune_g
+    
+    with _neptune_lock:
+        if _neptune_g is not None:
+            return _neptune_g
+        
+        try:
+            # For production, use IAM authentication
+            _neptune_connection = DriverRemoteConnection(f'wss://{endpoint}:8182/gremlin', 'g')
+            _neptune_g = traversal().withRemote(_neptune_connection)
+            return _neptune_g
+        except Exception as e:
+            print(f"Failed to connect to Neptune: {str(e)}")
+            # Return mock traversal for testing
+            return None
+
+
+def reset_neptune_connection():
+    """Drop the cached Neptune connection so the next call reconnects"""
+    global _neptune_connection, _neptune_g
+    
+    with _neptune_lock:
+        if _neptune_connection is not None:
+            try:
+                _neptune_connection.close()
+            except Exception as e:
+                print(f"Error closing Neptune connection: {str(e)}")
+        
+        _neptune_connection = None
+        _neptune_g = None
 
 
 def analyze_transaction_graph(g, transaction_data):
@@ -95,29 +136,37 @@ def analyze_transaction_graph(g, transaction_data):
         
         from_address = transaction_data.get('from_address', '')
         to_address = transaction_data.get('to_address', '')
-        amount = float(transaction_data.get('amount', 0))
         
-        # Check if addresses exist in graph
-        from_vertex = g.V().hasLabel('address').has('address', from_address).next()
-        to_vertex = g.V().hasLabel('address').has('address', to_address).next()
+        # Submit the shortest path search first so it runs on Neptune while
+        # the remaining metrics are fetched
+        path_future = start_path_length_query(g, from_address, to_address)
+        
+        # Use the nightly precomputed metrics; addresses first seen since the
+        # last run are counted live in a single round-trip
+        counts = fetch_precomputed_counts(g, from_address, to_address)
+        if counts is None:
+            counts = fetch_graph_counts(g, from_address, to_address)
         
         # Calculate centrality metrics
-        metrics['centrality'] = calculate_centrality(g, from_address, to_address)
+        metrics['centrality'] = calculate_centrality(counts['from_degree'], counts['to_degree'])
         
         # Calculate clustering coefficient
-        metrics['clustering'] = calculate_clustering_coefficient(g, from_address)
+        metrics['clustering'] = calculate_clustering_coefficient(counts['neighbors'], counts['links'])
         
         # Calculate shortest path length
-        metrics['path_length'] = calculate_path_length(g, from_address, to_address)
+        metrics['path_length'] = calculate_path_length(path_future)
         
         # Calculate transaction velocity
-        metrics['velocity'] = calculate_transaction_velocity(g, from_address)
+        metrics['velocity'] = calculate_transaction_velocity(counts['recent_transactions'])
         
         # Analyze connected components
-        metrics['component_size'] = analyze_connected_components(g, from_address)
+        metrics['component_size'] = counts['component_size']
         
     except Exception as e:
         print(f"Error in graph analysis: {str(e)}")
+        if not isinstance(e, StopIteration):
+            # The cached connection may be broken; reconnect on next use
+            reset_neptune_connection()
         metrics = get_mock_graph_metrics(transaction_data)
     
     return metrics
@@ -141,51 +190,124 @@ def get_mock_graph_metrics(transaction_data):
     }
 
 
-def calculate_centrality(g, from_address, to_address):
-    """Calculate betweenness centrality for addresses"""
-    try:
-        # Simplified centrality calculation
-        from_degree = g.V().hasLabel('address').has('address', from_address).both().count().next()
-        to_degree = g.V().hasLabel('address').has('address', to_address).both().count().next()
-        
-        # Normalize centrality score
-        max_degree = max(from_degree, to_degree)
-        return min(max_degree / 100.0, 1.0)  # Normalize to 0-1
-        
-    except Exception as e:
-        print(f"Error calculating centrality: {str(e)}")
-        return 0.5
+def cached_traversal_source(g):
+    """Traversal source whose results are served from Neptune's result cache"""
+    return g.with_('Neptune#enableResultCache', True).with_('evaluationTimeout', QUERY_TIMEOUT_MS)
 
 
-def calculate_clustering_coefficient(g, address):
-    """Calculate clustering coefficient for address"""
+def velocity_window_start():
+    """Start of the 24 hour velocity window"""
+    # The result cache is keyed on the query text, so the velocity window is
+    # aligned to the minute to let repeated lookups of hub addresses hit it.
+    return int(time.time()) // 60 * 60 - 86400
+
+
+def fetch_precomputed_counts(g, from_address, to_address):
+    """Build the ARSM counts from the address metrics table, or None if either address is missing"""
     try:
-        # Get neighbors
-        neighbors = g.V().hasLabel('address').has('address', address).both().toList()
+        response = dynamodb.batch_get_item(
+            RequestItems={
+                address_metrics_table.name: {
+                    'Keys': [{'address': address} for address in {from_address, to_address}]
+                }
+            }
+        )
+        items = {item['address']: item for item in response['Responses'].get(address_metrics_table.name, [])}
         
-        if len(neighbors) < 2:
-            return 0.0
+        if from_address not in items or to_address not in items:
+            return None
         
-        # Count edges between neighbors
-        edges_between_neighbors = 0
-        for i, neighbor1 in enumerate(neighbors):
-            for neighbor2 in neighbors[i+1:]:
-                if g.V(neighbor1).both().hasId(neighbor2.id).hasNext():
-                    edges_between_neighbors += 1
+        from_item = items[from_address]
         
-        # Calculate clustering coefficient
-        max_possible_edges = len(neighbors) * (len(neighbors) - 1) / 2
-        return edges_between_neighbors / max_possible_edges if max_possible_edges > 0 else 0.0
+        return {
+            'from_degree': int(from_item['degree']),
+            'to_degree': int(items[to_address]['degree']),
+            'neighbors': int(from_item['neighbors']),
+            'links': int(from_item['links']),
+            **fetch_live_counts(g, from_address)
+        }
         
     except Exception as e:
-        print(f"Error calculating clustering coefficient: {str(e)}")
-        return 0.3
+        print(f"Error fetching address metrics: {str(e)}")
+        return None
 
 
-def calculate_path_length(g, from_address, to_address):
+def fetch_live_counts(g, address):
+    """Count the address's velocity and component size, which are not precomputed"""
+    # Velocity depends on the current time, and the component size is the
+    # same bounded neighborhood count fetch_graph_counts uses
+    return (
+        cached_traversal_source(g).V().hasLabel('address').has('address', address)
+        .project('recent_transactions', 'component_size')
+        .by(__.bothE().has('timestamp', P.gt(velocity_window_start())).count().limit(1))
+        .by(__.repeat(__.both().simplePath()).emit().times(MAX_COMPONENT_HOPS).limit(MAX_COMPONENT_SIZE).count())
+        .next()
+    )
+
+
+def fetch_graph_counts(g, from_address, to_address):
+    """Fetch the raw graph counts used by ARSM in a single traversal"""
+    window_start = velocity_window_start()
+    
+    # Every link between two neighbors is seen from both ends, so 'links'
+    # is twice the number of neighbor pairs that have transacted. Each
+    # neighbor's matches are deduplicated so repeated transfers between the
+    # same pair count once, as in the address metrics job's triangle count.
+    #
+    # The degree and velocity counts end in limit(1): Neptune otherwise
+    # evaluates them in its default 1000-solution chunks (the chunk size
+    # reported by the profile API), which buffers far more than a single
+    # scalar needs on high-degree addresses.
+    return (
+        cached_traversal_source(g).V().hasLabel('address').has('address', from_address)
+        .project('from_degree', 'to_degree', 'neighbors', 'links', 'recent_transactions', 'component_size')
+        .by(__.both().count().limit(1))
+        .by(__.V().hasLabel('address').has('address', to_address).both().count().limit(1))
+        .by(__.both().dedup().count())
+        .by(__.both().dedup().aggregate('neighbors').local(__.both().where(P.within('neighbors')).dedup().count()).sum())
+        .by(__.bothE().has('timestamp', P.gt(window_start)).count().limit(1))
+        .by(__.repeat(__.both().simplePath()).emit().times(MAX_COMPONENT_HOPS).limit(MAX_COMPONENT_SIZE).count())
+        .next()
+    )
+
+
+def calculate_centrality(from_degree, to_degree):
+    """Calculate betweenness centrality for addresses"""
+    # Simplified centrality calculation
+    max_degree = max(from_degree, to_degree)
+    return min(max_degree / 100.0, 1.0)  # Normalize to 0-1
+
+
+def calculate_clustering_coefficient(neighbor_count, links):
+    """Calculate clustering coefficient for address"""
+    if neighbor_count < 2:
+        return 0.0
+    
+    max_possible_links = neighbor_count * (neighbor_count - 1)
+    return links / max_possible_links
+
+
+def start_path_length_query(g, from_address, to_address):
+    """Submit the path traversal without waiting for its result"""
+    # Walk depth-first so the target is reached without materializing the
+    # whole frontier of high-degree addresses at every hop
+    return (
+        cached_traversal_source(g)
+        .withSideEffect('Neptune#repeatMode', 'DFS')
+        .withSideEffect('Neptune#noReordering', True)
+        .V().hasLabel('address').has('address', from_address)
+        .repeat(__.both().simplePath())
+        .until(__.or_(__.hasLabel('address').has('address', to_address), __.loops().is_(MAX_PATH_HOPS)))
+        .hasLabel('address').has('address', to_address)
+        .path().limit(1)
+        .promise(lambda t: t.next())
+    )
+
+
+def calculate_path_length(path_future):
     """Calculate shortest path length between addresses"""
     try:
-        path = g.V().hasLabel('address').has('address', from_address).repeat(__.both().simplePath()).until(__.hasLabel('address').has('address', to_address)).path().next()
+        path = path_future.result()
         return len(path) - 1  # Number of edges in path
         
     except Exception as e:
@@ -193,67 +315,35 @@ def calculate_path_length(g, from_address, to_address):
         return 5  # Default path length
 
 
-def calculate_transaction_velocity(g, address):
+def calculate_transaction_velocity(recent_count):
     """Calculate transaction velocity for address"""
-    try:
-        # Count recent transactions (last 24 hours)
-        recent_count = g.V().hasLabel('address').has('address', address).bothE().has('timestamp', P.gt(time.time() - 86400)).count().next()
-        
-        # Normalize velocity score
-        return min(recent_count / 50.0, 1.0)  # Normalize to 0-1
-        
-    except Exception as e:
-        print(f"Error calculating velocity: {str(e)}")
-        return 0.2
-
-
-def analyze_connected_components(g, address):
-    """Analyze connected component size"""
-    try:
-        # Get connected component size
-        component_size = g.V().hasLabel('address').has('address', address).repeat(__.both().simplePath()).emit().count().next()
-        
-        return min(component_size, 10000)  # Cap at reasonable size
-        
-    except Exception as e:
-        print(f"Error analyzing connected components: {str(e)}")
-        return 100
+    # Normalize count of transactions in the last 24 hours
+    return min(recent_count / 50.0, 1.0)  # Normalize to 0-1
 
 
-def calculate_graph_risk_score(metrics):
-    """Calculate overall graph-based risk score"""
-    weights = {
-        'centrality': 0.3,
-        'clustering': 0.2,
-        'velocity': 0.25,
-        'path_length': 0.15,
-        'component_size': 0.1
-    }
-    
-    risk_score = 0.0
-    
-    # Centrality risk
-    risk_score += metrics.get('centrality', 0) * weights['centrality']
-    
-    # Clustering risk (low clustering can indicate suspicious behavior)
-    clustering = metrics.get('clustering', 0)
-    clustering_risk = 1.0 - clustering  # Invert clustering coefficient
-    risk_score += clustering_risk * weights['clustering']
-    
-    # Velocity risk
-    risk_score += metrics.get('velocity', 0) * weights['velocity']
-    
+def graph_risk_features(metrics):
+    """Build the per-component graph risk vector, ordered as GRAPH_RISK_WEIGHTS"""
     # Path length risk (very short or very long paths can be suspicious)
     path_length = metrics.get('path_length', 5)
     path_risk = 1.0 if path_length <= 2 or path_length >= 8 else 0.3
-    risk_score += path_risk * weights['path_length']
     
-    # Component size risk (very large components can indicate mixing)
-    component_size = metrics.get('component_size', 100)
-    component_risk = min(component_size / 1000.0, 1.0)
-    risk_score += component_risk * weights['component_size']
-    
-    return min(risk_score, 1.0)
+    return np.array([
+        # Centrality risk
+        metrics.get('centrality', 0),
+        # Clustering risk (low clustering can indicate suspicious behavior)
+        1.0 - metrics.get('clustering', 0),
+        # Velocity risk
+        metrics.get('velocity', 0),
+        path_risk,
+        # Component size risk (very large components can indicate mixing)
+        min(metrics.get('component_size', 100) / 1000.0, 1.0)
+    ])
+
+
+def calculate_graph_risk_score(metrics):
+    """Calculate overall graph-based risk score"""
+    risk_score = GRAPH_RISK_WEIGHTS @ graph_risk_features(metrics)
+    return float(min(risk_score, 1.0))
 
 
 def store_analysis_metadata(metadata_table, transaction_id, metrics):
@@ -264,8 +354,10 @@ def store_analysis_metadata(metadata_table, transaction_id, metrics):
                 'entity_id': transaction_id,
                 'timestamp': int(time.time()),
                 'analysis_type': 'arsm',
-                'metrics': metrics
+                # DynamoDB does not accept float attributes
+                'metrics': json.loads(json.dumps(metrics), parse_float=Decimal)
             }
         )
+        
     except Exception as e:
         print(f"Error storing metadata: {str(e)}")
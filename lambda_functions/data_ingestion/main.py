@@ -5,8 +5,35 @@ Handles blockchain data ingestion and preprocessing
 
 import json
 import boto3
+from botocore.config import Config
 import os
+import re
 import time
+import uuid
+
+
+BOTO_CONFIG = Config(max_pool_connections=50, tcp_keepalive=True, retries={'mode': 'adaptive'})
+sqs = boto3.client('sqs', config=BOTO_CONFIG)
+
+# Mock exchange rates - in production would use real-time rates
+EXCHANGE_RATES = {
+    'BTC': 45000,
+    'ETH': 3000,
+    'LTC': 100,
+    'BCH': 300,
+    'XRP': 0.6
+}
+
+# Address type by prefix
+ADDRESS_TYPES = {
+    '1': 'P2PKH',    # Pay to Public Key Hash
+    '3': 'P2SH',     # Pay to Script Hash
+    'bc1': 'BECH32', # Bech32
+    '0x': 'ETH'      # Ethereum
+}
+
+# Checks the minimum address length and captures the type prefix in one match
+ADDRESS_RE = re.compile(r'(?=.{26})(bc1|0x|[13])?', re.DOTALL)
 
 
 def handler(event, context):
@@ -15,10 +42,6 @@ def handler(event, context):
     Processes incoming blockchain transaction data
     """
     try:
-        # Initialize clients
-        s3 = boto3.client('s3')
-        glue = boto3.client('glue')
-        
         # Extract transaction data from event
         transaction_data = event.get('transaction', {})
         
@@ -34,16 +57,12 @@ def handler(event, context):
         # Enrich transaction data
         enriched_data = enrich_transaction_data(validated_data)
         
-        # Store raw data in S3
-        s3_key = store_raw_data(s3, enriched_data)
-        
-        # Trigger Glue ETL job if needed
-        glue_job_result = trigger_etl_processing(glue, s3_key)
+        # Queue raw data for the batched S3 write and ETL processing
+        message_id = queue_raw_data(sqs, enriched_data)
         
         result = {
             'transaction': enriched_data,
-            's3_location': s3_key,
-            'glue_job': glue_job_result,
+            'etl_message_id': message_id,
             'status': 'success',
             'timestamp': context.aws_request_id
         }
@@ -66,7 +85,6 @@ def handler(event, context):
 def generate_sample_transaction():
     """Generate sample transaction for testing"""
     import random
-    import uuid
     
     return {
         'id': str(uuid.uuid4()),
@@ -105,9 +123,16 @@ def validate_transaction_data(transaction_data):
     if validated['amount'] <= 0:
         raise ValueError("Invalid transaction amount")
     
-    if len(validated['from_address']) < 26 or len(validated['to_address']) < 26:
+    from_match = ADDRESS_RE.match(validated['from_address'])
+    to_match = ADDRESS_RE.match(validated['to_address'])
+    
+    if from_match is None or to_match is None:
         raise ValueError("Invalid address format")
     
+    # Address classifications
+    validated['from_address_type'] = ADDRESS_TYPES.get(from_match.group(1), 'UNKNOWN')
+    validated['to_address_type'] = ADDRESS_TYPES.get(to_match.group(1), 'UNKNOWN')
+    
     return validated
 
 
@@ -116,8 +141,9 @@ def enrich_transaction_data(transaction_data):
     enriched = transaction_data.copy()
     
     # Add processing metadata
-    enriched['processed_at'] = int(time.time())
-    enriched['processing_id'] = f"proc_{int(time.time())}"
+    now = int(time.time())
+    enriched['processed_at'] = now
+    enriched['processing_id'] = f"proc_{now}"
     
     # Add derived features
     enriched['amount_usd'] = estimate_usd_value(
@@ -128,10 +154,6 @@ def enrich_transaction_data(transaction_data):
     enriched['hour_of_day'] = (enriched['timestamp'] % 86400) // 3600
     enriched['day_of_week'] = ((enriched['timestamp'] // 86400) + 4) % 7  # 0=Monday
     
-    # Add address classifications
-    enriched['from_address_type'] = classify_address(enriched['from_address'])
-    enriched['to_address_type'] = classify_address(enriched['to_address'])
-    
     # Add transaction size category
     enriched['size_category'] = categorize_transaction_size(enriched['amount_usd'])
     
@@ -140,33 +162,10 @@ def enrich_transaction_data(transaction_data):
 
 def estimate_usd_value(amount, currency):
     """Estimate USD value of transaction"""
-    # Mock exchange rates - in production would use real-time rates
-    exchange_rates = {
-        'BTC': 45000,
-        'ETH': 3000,
-        'LTC': 100,
-        'BCH': 300,
-        'XRP': 0.6
-    }
-    
-    rate = exchange_rates.get(currency, 1)
+    rate = EXCHANGE_RATES.get(currency, 1)
     return round(amount * rate, 2)
 
 
-def classify_address(address):
-    """Classify address type based on patterns"""
-    if address.startswith('1'):
-        return 'P2PKH'  # Pay to Public Key Hash
-    elif address.startswith('3'):
-        return 'P2SH'   # Pay to Script Hash
-    elif address.startswith('bc1'):
-        return 'BECH32' # Bech32
-    elif address.startswith('0x'):
-        return 'ETH'    # Ethereum
-    else:
-        return 'UNKNOWN'
-
-
 def categorize_transaction_size(usd_amount):
     """Categorize transaction by USD amount"""
     if usd_amount < 100:
@@ -181,74 +180,22 @@ def categorize_transaction_size(usd_amount):
         return 'WHALE'
 
 
-def store_raw_data(s3_client, transaction_data):
-    """Store raw transaction data in S3"""
+def queue_raw_data(sqs_client, transaction_data):
+    """Queue a raw transaction for the next scheduled ETL run, which writes queued transactions to S3 in batches"""
     try:
-        bucket = os.environ['DATA_BUCKET']
-        
-        # Create S3 key with partitioning
-        timestamp = transaction_data['timestamp']
-        year = time.strftime('%Y', time.gmtime(timestamp))
-        month = time.strftime('%m', time.gmtime(timestamp))
-        day = time.strftime('%d', time.gmtime(timestamp))
+        queue_url = os.environ.get('ETL_QUEUE_URL')
         
-        s3_key = f"raw-transactions/year={year}/month={month}/day={day}/{transaction_data['id']}.json"
+        if not queue_url:
+            print("No ETL queue configured")
+            return None
         
-        # Store data
-        s3_client.put_object(
-            Bucket=bucket,
-            Key=s3_key,
-            Body=json.dumps(transaction_data, indent=2),
-            ContentType='application/json'
+        response = sqs_client.send_message(
+            QueueUrl=queue_url,
+            MessageBody=json.dumps(transaction_data)
         )
         
-        print(f"Stored transaction data at s3://{bucket}/{s3_key}")
-        return s3_key
+        return response['MessageId']
         
     except Exception as e:
-        print(f"Error storing data in S3: {str(e)}")
+        print(f"Error queueing ETL input: {str(e)}")
         return None
-
-
-def trigger_etl_processing(glue_client, s3_key):
-    """Trigger Glue ETL job for data processing"""
-    try:
-        job_name = os.environ.get('GLUE_JOB_NAME')
-        
-        if not job_name:
-            print("No Glue job configured")
-            return {'status': 'skipped', 'reason': 'no_job_configured'}
-        
-        # Check if job should be triggered (e.g., batch processing)
-        if should_trigger_etl():
-            response = glue_client.start_job_run(
-                JobName=job_name,
-                Arguments={
-                    '--input_path': s3_key,
-                    '--job_bookmark_option': 'job-bookmark-enable'
-                }
-            )
-            
-            return {
-                'status': 'triggered',
-                'job_run_id': response['JobRunId']
-            }
-        else:
-            return {
-                'status': 'skipped',
-                'reason': 'batch_threshold_not_met'
-            }
-            
-    except Exception as e:
-        print(f"Error triggering Glue job: {str(e)}")
-        return {
-            'status': 'error',
-            'error': str(e)
-        }
-
-
-def should_trigger_etl():
-    """Determine if ETL job should be triggered"""
-    # Simple logic - in production would check batch size, timing, etc.
-    import random
-    return random.random() < 0.1  # 10% chance for demo
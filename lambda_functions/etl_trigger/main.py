@@ -0,0 +1,274 @@
+"""
+ETL Trigger Lambda
+Drains queued raw transactions, writes them to S3 in batches and starts one
+Glue ETL job run for them
+"""
+
+import io
+import json
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+import time
+import uuid
+
+
+BOTO_CONFIG = Config(tcp_keepalive=True, retries={'mode': 'adaptive'})
+s3 = boto3.client('s3', config=BOTO_CONFIG)
+sqs = boto3.client('sqs', config=BOTO_CONFIG)
+glue = boto3.client('glue', config=BOTO_CONFIG)
+
+# Upper bound on the number of transactions written per drained batch
+MAX_BATCH_RECORDS = int(os.environ.get('MAX_BATCH_RECORDS', '50000'))
+
+# Time left for writing the last batch and starting the job run once draining stops
+DRAIN_RESERVE_MS = 30000
+
+# Batches written to S3 and not yet processed by a successful job run
+MANIFEST_PREFIX = 'etl-manifests/'
+MAX_MANIFESTS_PER_RUN = 100
+ACTIVE_RUN_STATES = ('STARTING', 'RUNNING', 'STOPPING', 'WAITING')
+
+# Columns of the raw Parquet objects; currency and date are encoded in the
+# partition path instead
+RAW_TRANSACTION_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('from_address', pa.string()),
+    ('to_address', pa.string()),
+    ('amount', pa.float64()),
+    ('timestamp', pa.int64()),
+    ('block_height', pa.int64()),
+    ('gas_price', pa.int64()),
+    ('gas_used', pa.int64()),
+    ('from_address_type', pa.string()),
+    ('to_address_type', pa.string()),
+    ('processed_at', pa.int64()),
+    ('processing_id', pa.string()),
+    ('amount_usd', pa.float64()),
+    ('hour_of_day', pa.int32()),
+    ('day_of_week', pa.int32()),
+    ('size_category', pa.string())
+])
+
+
+def handler(event, context):
+    """
+    Main handler for the ETL trigger
+    Invoked on a schedule to submit queued transactions to Glue
+    """
+    try:
+        queue_url = os.environ['ETL_QUEUE_URL']
+        bucket = os.environ['DATA_BUCKET']
+        
+        # Drain the queue into S3 while time allows; each drained batch is
+        # recorded in a manifest before its messages are deleted
+        records_stored = 0
+        while context.get_remaining_time_in_millis() > DRAIN_RESERVE_MS:
+            messages = receive_queued_records(sqs, queue_url, context)
+            if not messages:
+                break
+            
+            records = parse_records(messages)
+            if records:
+                # One Parquet object per currency and date partition
+                input_paths = store_raw_batches(s3, bucket, records)
+                write_manifest(s3, bucket, f"{MANIFEST_PREFIX}{int(time.time())}-{uuid.uuid4()}.json", input_paths)
+                records_stored += len(records)
+            
+            delete_messages(sqs, queue_url, messages)
+        
+        # Batches not yet processed, including those from failed runs
+        manifests = pending_manifests(s3, glue, bucket)
+        
+        job_result = {'status': 'skipped', 'reason': 'nothing_pending'}
+        if manifests:
+            # Start one job run for every pending batch
+            job_result = start_etl_job(glue, [path for manifest in manifests.values() for path in manifest['input_paths']])
+            
+            # Manifests are removed once their run succeeds
+            if job_result['status'] == 'triggered':
+                for key, manifest in manifests.items():
+                    write_manifest(s3, bucket, key, manifest['input_paths'], job_result['job_run_id'])
+        
+        result = {
+            'records': records_stored,
+            'pending_batches': len(manifests),
+            'glue_job': job_result
+        }
+        
+        print(f"ETL trigger result: {result}")
+        
+        return {
+            'statusCode': 200,
+            'body': result
+        }
+    
+    except Exception as e:
+        print(f"Error in ETL trigger: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': {'error': str(e)}
+        }
+
+
+def receive_queued_records(sqs_client, queue_url, context):
+    """Receive up to MAX_BATCH_RECORDS queued messages"""
+    messages = []
+    
+    while len(messages) < MAX_BATCH_RECORDS and context.get_remaining_time_in_millis() > DRAIN_RESERVE_MS:
+        response = sqs_client.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(10, MAX_BATCH_RECORDS - len(messages)),
+            WaitTimeSeconds=1
+        )
+        
+        batch = response.get('Messages', [])
+        if not batch:
+            break
+        
+        messages.extend(batch)
+    
+    return messages
+
+
+def parse_records(messages):
+    """Decode the queued transactions, skipping malformed messages"""
+    records = []
+    
+    for message in messages:
+        try:
+            records.append(json.loads(message['Body']))
+        except ValueError as e:
+            # Deleted with the rest of the batch; a retry cannot parse it either
+            print(f"Skipping malformed ETL message {message.get('MessageId')}: {str(e)}")
+    
+    return records
+
+
+def store_raw_batches(s3_client, bucket, records):
+    """Write transactions to S3 as one Snappy Parquet object per currency and date"""
+    partitions = {}
+    for record in records:
+        date = time.strftime('%Y-%m-%d', time.gmtime(record['timestamp']))
+        partitions.setdefault((record['currency'], date), []).append(record)
+    
+    input_paths = []
+    for (currency, date), partition_records in partitions.items():
+        s3_key = f"raw-transactions/currency={currency}/date={date}/batch-{uuid.uuid4()}.parquet"
+        
+        body = io.BytesIO()
+        pq.write_table(
+            pa.Table.from_pylist(partition_records, schema=RAW_TRANSACTION_SCHEMA),
+            body,
+            compression='snappy'
+        )
+        
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=s3_key,
+            Body=body.getvalue(),
+            ContentType='application/vnd.apache.parquet'
+        )
+        
+        print(f"Stored {len(partition_records)} transactions at s3://{bucket}/{s3_key}")
+        input_paths.append(f"{bucket}/{s3_key}")
+    
+    return input_paths
+
+
+def write_manifest(s3_client, bucket, key, input_paths, job_run_id=None):
+    """Record a written batch and the job run processing it, if any"""
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps({'input_paths': input_paths, 'job_run_id': job_run_id}),
+        ContentType='application/json'
+    )
+
+
+def pending_manifests(s3_client, glue_client, bucket):
+    """Load the manifests of batches that no active or successful run covers, oldest first"""
+    job_name = os.environ.get('GLUE_JOB_NAME')
+    manifests = {}
+    
+    keys = []
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=MANIFEST_PREFIX):
+        keys.extend(item['Key'] for item in page.get('Contents', []))
+    
+    for key in sorted(keys):
+        manifest = json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+        
+        if manifest.get('job_run_id') and job_name:
+            try:
+                state = glue_client.get_job_run(JobName=job_name, RunId=manifest['job_run_id'])['JobRun']['JobRunState']
+            except ClientError as e:
+                # Runs Glue no longer knows about are submitted again; otherwise check next time
+                if e.response['Error']['Code'] != 'EntityNotFoundException':
+                    print(f"Error checking Glue job run {manifest['job_run_id']}: {str(e)}")
+                    continue
+                state = None
+            
+            if state == 'SUCCEEDED':
+                s3_client.delete_object(Bucket=bucket, Key=key)
+                continue
+            
+            if state in ACTIVE_RUN_STATES:
+                continue
+        
+        manifests[key] = manifest
+        if len(manifests) >= MAX_MANIFESTS_PER_RUN:
+            break
+    
+    return manifests
+
+
+def start_etl_job(glue_client, input_paths):
+    """Start the Glue ETL job for a list of S3 paths"""
+    try:
+        job_name = os.environ.get('GLUE_JOB_NAME')
+        
+        if not job_name:
+            print("No Glue job configured")
+            return {'status': 'skipped', 'reason': 'no_job_configured'}
+        
+        arguments = {
+            '--input_paths': ','.join(input_paths)
+        }
+        
+        # The job also loads the batch into the transaction graph when it knows the endpoint
+        neptune_endpoint = os.environ.get('NEPTUNE_ENDPOINT')
+        if neptune_endpoint:
+            arguments['--neptune_endpoint'] = neptune_endpoint
+        
+        response = glue_client.start_job_run(
+            JobName=job_name,
+            Arguments=arguments
+        )
+        
+        return {
+            'status': 'triggered',
+            'job_run_id': response['JobRunId']
+        }
+    
+    except Exception as e:
+        # Manifests stay pending and are submitted again on the next run
+        print(f"Error triggering Glue job: {str(e)}")
+        return {
+            'status': 'error',
+            'error': str(e)
+        }
+
+
+def delete_messages(sqs_client, queue_url, messages):
+    """Delete processed messages from the queue"""
+    for i in range(0, len(messages), 10):
+        sqs_client.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {'Id': str(n), 'ReceiptHandle': message['ReceiptHandle']}
+                for n, message in enumerate(messages[i:i + 10])
+            ]
+        )
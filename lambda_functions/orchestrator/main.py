@@ -4,19 +4,30 @@ Handles API requests and orchestrates Step Functions execution
 """
 
 import json
+import logging
 import boto3
+from botocore.config import Config
 import os
 import uuid
 import time
 
 
+BOTO_CONFIG = Config(max_pool_connections=50, tcp_keepalive=True, retries={'mode': 'adaptive'})
+stepfunctions = boto3.client('stepfunctions', config=BOTO_CONFIG)
+
+# Full request events are only logged when DEBUG=1
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG if os.environ.get('DEBUG') == '1' else logging.INFO)
+
+
 def handler(event, context):
     """
     Main handler for orchestrator
     Routes API requests and manages workflow execution
     """
     try:
-        print(f"Orchestrator event: {json.dumps(event, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Orchestrator event: %s", json.dumps(event))
         
         # Determine the operation based on the API path
         http_method = event.get('httpMethod', 'POST')
@@ -37,7 +48,7 @@ def handler(event, context):
             }
         
     except Exception as e:
-        print(f"Error in orchestrator: {str(e)}")
+        logger.error("Error in orchestrator: %s", e)
         return {
             'statusCode': 500,
             'headers': {
@@ -73,36 +84,46 @@ def handle_analyze_request(event, context):
             }
         
         # Start Step Functions execution
-        stepfunctions = boto3.client('stepfunctions')
-        
         execution_input = {
             'transaction': transaction_data,
             'request_id': context.aws_request_id,
             'timestamp': int(time.time())
         }
         
-        response = stepfunctions.start_execution(
-            stateMachineArn=os.environ.get('STEP_FUNCTION_ARN'),
-            name=f"raid-x-{transaction_data['id']}-{int(time.time())}",
-            input=json.dumps(execution_input)
-        )
+        # The execution name is derived from the transaction alone, so a
+        # retried request maps onto the execution that is already running
+        state_machine_arn = os.environ.get('STEP_FUNCTION_ARN')
+        execution_name = f"raid-x-{transaction_data['id']}"
+        
+        try:
+            response = stepfunctions.start_execution(
+                stateMachineArn=state_machine_arn,
+                name=execution_name,
+                input=json.dumps(execution_input, separators=(',', ':'))
+            )
+            execution_arn = response['executionArn']
+            message = 'Analysis started'
+            
+        except stepfunctions.exceptions.ExecutionAlreadyExists:
+            execution_arn = f"{state_machine_arn.replace(':stateMachine:', ':execution:')}:{execution_name}"
+            message = 'Analysis already started'
         
         return {
-            'statusCode': 200,
+            'statusCode': 202,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
             'body': json.dumps({
-                'message': 'Analysis started',
-                'execution_arn': response['executionArn'],
+                'message': message,
+                'execution_arn': execution_arn,
                 'transaction_id': transaction_data['id'],
                 'status': 'RUNNING'
             })
         }
         
     except Exception as e:
-        print(f"Error handling analyze request: {str(e)}")
+        logger.error("Error handling analyze request: %s", e)
         return {
             'statusCode': 500,
             'headers': {
@@ -132,7 +153,7 @@ def handle_status_request(event, context):
             return get_system_status()
             
     except Exception as e:
-        print(f"Error handling status request: {str(e)}")
+        logger.error("Error handling status request: %s", e)
         return {
             'statusCode': 500,
             'headers': {
@@ -146,8 +167,6 @@ def handle_status_request(event, context):
 def check_execution_status(execution_arn):
     """Check Step Functions execution status"""
     try:
-        stepfunctions = boto3.client('stepfunctions')
-        
         response = stepfunctions.describe_execution(
             executionArn=execution_arn
         )
@@ -182,7 +201,7 @@ def check_execution_status(execution_arn):
         }
         
     except Exception as e:
-        print(f"Error checking execution status: {str(e)}")
+        logger.error("Error checking execution status: %s", e)
         return {
             'statusCode': 500,
             'headers': {
@@ -214,7 +233,7 @@ def lookup_transaction_status(transaction_id):
         }
         
     except Exception as e:
-        print(f"Error looking up transaction: {str(e)}")
+        logger.error("Error looking up transaction: %s", e)
         return {
             'statusCode': 500,
             'headers': {
@@ -3,10 +3,90 @@ R3 Engine - Rule-Based Regulatory Risk Engine
 Implements compliance screening for known risks
 """
 
-import json
+import re
+import orjson
 import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
 import os
-from decimal import Decimal
+import time
+from collections import namedtuple
+
+# pyahocorasick is optional; without it mixer patterns are matched with a regex
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# The DAX client is optional; without it config reads go straight to DynamoDB
+try:
+    from amazondax import AmazonDaxClient
+except ImportError:
+    AmazonDaxClient = None
+
+
+class FloatDeserializer(TypeDeserializer):
+    """Deserialize DynamoDB numbers as floats instead of Decimals"""
+    
+    def _deserialize_n(self, value):
+        return float(value)
+
+
+BOTO_CONFIG = Config(max_pool_connections=50, tcp_keepalive=True)
+
+
+def create_dynamodb_client():
+    """DAX client when a cluster is configured and reachable, otherwise a DynamoDB client"""
+    if os.environ.get('DAX_ENDPOINT'):
+        if AmazonDaxClient is None:
+            print("amazondax is not installed, reading from DynamoDB")
+        else:
+            try:
+                return AmazonDaxClient(endpoint_url=os.environ['DAX_ENDPOINT'])
+            except Exception as e:
+                print(f"Could not connect to DAX, reading from DynamoDB: {str(e)}")
+    
+    return boto3.client('dynamodb', config=BOTO_CONFIG)
+
+
+dynamodb = create_dynamodb_client()
+
+CONFIG_TABLE = os.environ['CONFIG_TABLE']
+DESERIALIZER = FloatDeserializer()
+
+# Compliance rules are cached per container and reloaded after this many seconds
+RULES_CACHE_TTL_SECONDS = float(os.environ.get('RULES_CACHE_TTL_SECONDS', '60'))
+
+_rules_cache = None
+_rules_cached_at = 0.0
+
+# Loaded compliance rules, flattened to the fields apply_compliance_rules reads
+RuleSet = namedtuple('RuleSet', [
+    'ofac_enabled', 'ofac_weight',
+    'high_value_enabled', 'high_value_threshold', 'high_value_weight',
+    'mixer_enabled', 'mixer_weight'
+])
+
+# Simplified check - in production would check against actual OFAC list
+SANCTIONED_ADDRESSES = frozenset([
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa',  # Example addresses
+    '3FupnqxAUJ1ZmZVVkTnEPCCCQh6X8D',
+])
+
+# Simplified check - in production would check against mixer address database
+MIXER_PATTERNS = ('mix', 'tumbl', 'tornado')
+
+# Automaton matching every mixer pattern in a single scan
+if ahocorasick is not None:
+    MIXER_AUTOMATON = ahocorasick.Automaton()
+    for pattern in MIXER_PATTERNS:
+        MIXER_AUTOMATON.add_word(pattern, pattern)
+    MIXER_AUTOMATON.make_automaton()
+else:
+    MIXER_AUTOMATON = None
+
+# Single alternation used when the automaton is unavailable
+MIXER_RE = re.compile('|'.join(re.escape(pattern) for pattern in MIXER_PATTERNS))
 
 
 def handler(event, context):
@@ -15,10 +95,6 @@ def handler(event, context):
     Performs rule-based compliance screening
     """
     try:
-        # Initialize AWS clients
-        dynamodb = boto3.resource('dynamodb')
-        config_table = dynamodb.Table(os.environ['CONFIG_TABLE'])
-        
         # Extract transaction data
         transaction_data = event.get('transaction', {})
         transaction_id = transaction_data.get('id', 'unknown')
@@ -26,13 +102,13 @@ def handler(event, context):
         print(f"Processing transaction {transaction_id} with R3 Engine")
         
         # Load compliance rules
-        rules = load_compliance_rules(config_table)
+        rules = load_compliance_rules(dynamodb)
         
         # Apply rules
-        risk_flags = apply_compliance_rules(transaction_data, rules)
+        risk_flags, total_weight = apply_compliance_rules(transaction_data, rules)
         
         # Calculate risk score
-        risk_score = calculate_compliance_risk_score(risk_flags)
+        risk_score = calculate_compliance_risk_score(total_weight, len(risk_flags))
         
         result = {
             'transaction_id': transaction_id,
@@ -42,7 +118,7 @@ def handler(event, context):
             'timestamp': context.aws_request_id
         }
         
-        print(f"R3 Engine result: {result}")
+        print(f"R3 Engine result: {orjson.dumps(result).decode()}")
         
         return {
             'statusCode': 200,
@@ -57,22 +133,58 @@ def handler(event, context):
         }
 
 
-def load_compliance_rules(config_table):
-    """Load compliance rules from DynamoDB"""
+def load_compliance_rules(dynamodb_client):
+    """Load compliance rules from DynamoDB, reusing recently loaded rules"""
+    global _rules_cache, _rules_cached_at
+    
+    now = time.time()
+    if _rules_cache is not None and now - _rules_cached_at < RULES_CACHE_TTL_SECONDS:
+        return _rules_cache
+    
     try:
-        response = config_table.query(
-            KeyConditionExpression='config_type = :type',
-            ExpressionAttributeValues={':type': 'compliance_rules'}
+        # The whole ruleset is stored as one item
+        response = dynamodb_client.get_item(
+            TableName=CONFIG_TABLE,
+            Key={'config_type': {'S': 'compliance_rules'}, 'config_key': {'S': 'current'}}
         )
         
-        rules = {}
-        for item in response.get('Items', []):
-            rules[item['config_key']] = item.get('config_value', {})
+        rules = response.get('Item', {}).get('rules')
+        if rules is None:
+            print("No compliance rules configured, using defaults")
+            rules = get_default_compliance_rules()
+        else:
+            rules = DESERIALIZER.deserialize(rules)
         
+        rules = build_rule_set(rules)
+        
+        _rules_cache = rules
+        _rules_cached_at = now
         return rules
     except Exception as e:
         print(f"Error loading compliance rules: {str(e)}")
-        return get_default_compliance_rules()
+        return build_rule_set(get_default_compliance_rules())
+
+
+def build_rule_set(rules):
+    """Flatten a compliance rules dict into a RuleSet"""
+    ofac = rules.get('ofac_sanctions', {})
+    high_value = rules.get('high_value_threshold', {})
+    mixer = rules.get('mixer_detection', {})
+    
+    ofac_enabled = bool(ofac.get('enabled', False))
+    high_value_enabled = bool(high_value.get('enabled', False))
+    mixer_enabled = bool(mixer.get('enabled', False))
+    
+    # Settings of disabled rules are never read
+    return RuleSet(
+        ofac_enabled=ofac_enabled,
+        ofac_weight=float(ofac['risk_weight']) if ofac_enabled else 0.0,
+        high_value_enabled=high_value_enabled,
+        high_value_threshold=float(high_value['threshold']) if high_value_enabled else 0.0,
+        high_value_weight=float(high_value['risk_weight']) if high_value_enabled else 0.0,
+        mixer_enabled=mixer_enabled,
+        mixer_weight=float(mixer['risk_weight']) if mixer_enabled else 0.0
+    )
 
 
 def get_default_compliance_rules():
@@ -100,77 +212,73 @@ def get_default_compliance_rules():
 
 
 def apply_compliance_rules(transaction_data, rules):
-    """Apply compliance rules to transaction"""
+    """Apply a RuleSet to a transaction, returning the flags and their total weight"""
     risk_flags = []
+    total_weight = 0.0
     
     # OFAC sanctions check
-    if rules.get('ofac_sanctions', {}).get('enabled', False):
-        if check_ofac_sanctions(transaction_data):
-            risk_flags.append({
-                'rule': 'ofac_sanctions',
-                'description': 'Address appears on OFAC sanctions list',
-                'risk_weight': rules['ofac_sanctions']['risk_weight']
-            })
+    if rules.ofac_enabled and check_ofac_sanctions(transaction_data):
+        risk_flags.append({
+            'rule': 'ofac_sanctions',
+            'description': 'Address appears on OFAC sanctions list',
+            'risk_weight': rules.ofac_weight
+        })
+        total_weight += rules.ofac_weight
     
     # High value threshold check
-    if rules.get('high_value_threshold', {}).get('enabled', False):
-        threshold = rules['high_value_threshold']['threshold']
+    if rules.high_value_enabled:
         amount = float(transaction_data.get('amount', 0))
-        if amount > threshold:
+        if amount > rules.high_value_threshold:
             risk_flags.append({
                 'rule': 'high_value_threshold',
-                'description': f'Transaction amount {amount} exceeds threshold {threshold}',
-                'risk_weight': rules['high_value_threshold']['risk_weight']
+                'description': f'Transaction amount {amount} exceeds threshold {rules.high_value_threshold}',
+                'risk_weight': rules.high_value_weight
             })
+            total_weight += rules.high_value_weight
     
     # Mixer detection
-    if rules.get('mixer_detection', {}).get('enabled', False):
-        if check_mixer_involvement(transaction_data):
-            risk_flags.append({
-                'rule': 'mixer_detection',
-                'description': 'Transaction involves known mixing service',
-                'risk_weight': rules['mixer_detection']['risk_weight']
-            })
+    if rules.mixer_enabled and check_mixer_involvement(transaction_data):
+        risk_flags.append({
+            'rule': 'mixer_detection',
+            'description': 'Transaction involves known mixing service',
+            'risk_weight': rules.mixer_weight
+        })
+        total_weight += rules.mixer_weight
     
-    return risk_flags
+    return risk_flags, total_weight
 
 
 def check_ofac_sanctions(transaction_data):
     """Check if addresses are on OFAC sanctions list"""
-    # Simplified check - in production would check against actual OFAC list
-    sanctioned_addresses = [
-        '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa',  # Example addresses
-        '3FupnqxAUJ1ZmZVVkTnEPCCCQh6X8D',
-    ]
-    
     from_address = transaction_data.get('from_address', '')
     to_address = transaction_data.get('to_address', '')
     
-    return from_address in sanctioned_addresses or to_address in sanctioned_addresses
+    return from_address in SANCTIONED_ADDRESSES or to_address in SANCTIONED_ADDRESSES
 
 
 def check_mixer_involvement(transaction_data):
     """Check if transaction involves known mixers"""
-    # Simplified check - in production would check against mixer address database
-    mixer_patterns = ['mix', 'tumbl', 'tornado']
-    
     from_address = transaction_data.get('from_address', '').lower()
     to_address = transaction_data.get('to_address', '').lower()
     
-    for pattern in mixer_patterns:
-        if pattern in from_address or pattern in to_address:
-            return True
+    # The separator keeps a match from spanning both addresses
+    addresses = f"{from_address}\x00{to_address}"
+    
+    if MIXER_AUTOMATON is None:
+        return MIXER_RE.search(addresses) is not None
+    
+    for _ in MIXER_AUTOMATON.iter(addresses):
+        return True
     
     return False
 
 
-def calculate_compliance_risk_score(risk_flags):
+def calculate_compliance_risk_score(total_weight, flag_count):
     """Calculate overall compliance risk score"""
-    if not risk_flags:
+    if not flag_count:
         return 0.0
     
     # Weighted average of risk flags
-    total_weight = sum(flag['risk_weight'] for flag in risk_flags)
-    max_possible_weight = len(risk_flags)  # Assuming max risk weight is 1.0
+    max_possible_weight = flag_count  # Assuming max risk weight is 1.0
     
     return min(total_weight / max_possible_weight, 1.0) if max_possible_weight > 0 else 0.0
@@ -4,33 +4,52 @@ Implements ML-based anomaly detection with SHAP explanations
 """
 
 import json
+import orjson
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import os
 import numpy as np
-import joblib
 from io import BytesIO
+from decimal import Decimal
 import time
 
 
+BOTO_CONFIG = Config(max_pool_connections=50, tcp_keepalive=True)
+s3 = boto3.client('s3', config=BOTO_CONFIG)
+stepfunctions = boto3.client('stepfunctions', config=BOTO_CONFIG)
+dynamodb = boto3.resource('dynamodb', config=BOTO_CONFIG)
+results_table = dynamodb.Table(os.environ['RESULTS_TABLE'])
+
+# Order of the values returned by prepare_features
+FEATURE_ORDER = (
+    'amount', 'hour_of_day', 'r3_risk_score', 'arsm_risk_score',
+    'centrality', 'clustering', 'velocity', 'component_size'
+)
+FEATURE_POSITIONS = {name: i for i, name in enumerate(FEATURE_ORDER)}
+
+# Task tokens Step Functions no longer accepts; their messages are dropped
+TASK_TOKEN_ERRORS = ('TaskTimedOut', 'TaskDoesNotExist', 'InvalidToken')
+MAX_TASK_FAILURE_CAUSE = 32768
+
+# Model loaded from S3 on first use
+_model = None
+
+
 def handler(event, context):
     """
     Main handler for TAD-X
     Performs ML-based anomaly detection with explanations
     """
+    # Batches of workflow tasks queued by Step Functions
+    if 'Records' in event:
+        return handle_batch(event, context)
+    
     try:
-        # Initialize clients
-        s3 = boto3.client('s3')
-        dynamodb = boto3.resource('dynamodb')
-        results_table = dynamodb.Table(os.environ['RESULTS_TABLE'])
-        
         # Extract data from previous steps
-        transaction_data = event.get('transaction', {})
-        r3_result = event.get('r3_result', {}).get('Payload', {}).get('body', {})
-        arsm_result = event.get('arsm_result', {}).get('Payload', {}).get('body', {})
-        
-        transaction_id = transaction_data.get('id', 'unknown')
+        transaction_data, r3_result, arsm_result = parse_step_input(event)
         
-        print(f"Processing transaction {transaction_id} with TAD-X")
+        print(f"Processing transaction {transaction_data.get('id', 'unknown')} with TAD-X")
         
         # Load ML model
         model = load_ml_model(s3)
@@ -41,37 +60,15 @@ def handler(event, context):
         # Make prediction
         prediction, probability = predict_fraud(model, features)
         
-        # Generate SHAP explanations
-        explanations = generate_shap_explanations(model, features)
-        
-        # Calculate final risk score
-        final_risk_score = calculate_final_risk_score(
-            r3_result.get('r3_risk_score', 0),
-            arsm_result.get('arsm_risk_score', 0),
-            probability
+        result = build_result(
+            model, transaction_data, r3_result, arsm_result,
+            features, prediction, probability, context.aws_request_id
         )
         
-        # Store results
-        result = {
-            'transaction_id': transaction_id,
-            'final_prediction': prediction,
-            'fraud_probability': probability,
-            'final_risk_score': final_risk_score,
-            'risk_category': get_risk_category(final_risk_score),
-            'explanations': explanations,
-            'model_features': features,
-            'component_scores': {
-                'r3_score': r3_result.get('r3_risk_score', 0),
-                'arsm_score': arsm_result.get('arsm_risk_score', 0),
-                'ml_score': probability
-            },
-            'timestamp': context.aws_request_id
-        }
-        
         # Store in DynamoDB
-        store_results(results_table, result)
+        store_results_bulk(results_table, [result])
         
-        print(f"TAD-X result: {result}")
+        print(f"TAD-X result: {orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY).decode()}")
         
         return {
             'statusCode': 200,
@@ -86,9 +83,149 @@ def handler(event, context):
         }
 
 
+def handle_batch(event, context):
+    """Score a batch of queued workflow tasks and report each result back to Step Functions"""
+    failures = []
+    tasks = []
+    
+    for record in event['Records']:
+        try:
+            message = orjson.loads(record['body'])
+            task_token = message['task_token']
+        except Exception as e:
+            # Without a task token the workflow cannot be told; the queue's
+            # redrive policy moves the message to the dead-letter queue
+            print(f"Error parsing TAD-X message {record.get('messageId')}: {str(e)}")
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
+        
+        try:
+            step_input = parse_step_input(message['input'])
+            tasks.append((record['messageId'], task_token, step_input, prepare_features(*step_input)))
+        except Exception as e:
+            print(f"Error parsing TAD-X message {record['messageId']}: {str(e)}")
+            if not report_task_failure(task_token, 'TADXInputError', e):
+                failures.append({'itemIdentifier': record['messageId']})
+    
+    if not tasks:
+        return {'batchItemFailures': failures}
+    
+    print(f"Processing {len(tasks)} transactions with TAD-X")
+    
+    try:
+        # Load ML model
+        model = load_ml_model(s3)
+        
+        # Score the whole batch at once
+        predictions = predict_fraud_batch(model, [features for _, _, _, features in tasks])
+        
+    except Exception as e:
+        print(f"Error in TAD-X: {str(e)}")
+        for message_id, task_token, _, _ in tasks:
+            if not report_task_failure(task_token, 'TADXScoringError', e):
+                failures.append({'itemIdentifier': message_id})
+        return {'batchItemFailures': failures}
+    
+    completed = []
+    for (message_id, task_token, step_input, features), (prediction, probability) in zip(tasks, predictions):
+        try:
+            result = build_result(model, *step_input, features, prediction, probability, context.aws_request_id)
+            completed.append((message_id, task_token, result))
+        except Exception as e:
+            print(f"Error completing TAD-X task {message_id}: {str(e)}")
+            if not report_task_failure(task_token, 'TADXScoringError', e):
+                failures.append({'itemIdentifier': message_id})
+    
+    # Store in DynamoDB; nothing is reported as successful unless the results were written
+    try:
+        store_results_bulk(results_table, [result for _, _, result in completed])
+    except Exception as e:
+        # Retried with the rest of the batch, then dead-lettered if the writes keep failing
+        print(f"Error storing results: {str(e)}")
+        return {'batchItemFailures': failures + [{'itemIdentifier': message_id} for message_id, _, _ in completed]}
+    
+    for message_id, task_token, result in completed:
+        try:
+            # Resume the waiting workflow with the same output the direct invocation returns
+            stepfunctions.send_task_success(
+                taskToken=task_token,
+                output=orjson.dumps({'statusCode': 200, 'body': result}, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+            )
+        except Exception as e:
+            print(f"Error completing TAD-X task {message_id}: {str(e)}")
+            if not is_task_token_error(e):
+                failures.append({'itemIdentifier': message_id})
+    
+    return {'batchItemFailures': failures}
+
+
+def report_task_failure(task_token, error, exception):
+    """Fail a waiting workflow task; returns False if its message should be retried"""
+    try:
+        stepfunctions.send_task_failure(taskToken=task_token, error=error, cause=str(exception)[:MAX_TASK_FAILURE_CAUSE])
+        return True
+        
+    except Exception as e:
+        print(f"Error failing TAD-X task: {str(e)}")
+        return is_task_token_error(e)
+
+
+def is_task_token_error(error):
+    """Whether Step Functions rejected the task token, so retrying the message cannot succeed"""
+    return isinstance(error, ClientError) and error.response['Error']['Code'] in TASK_TOKEN_ERRORS
+
+
+def parse_step_input(event):
+    """Extract the transaction and the R3 Engine and ARSM results from the workflow state"""
+    transaction_data = event.get('transaction', {})
+    
+    # Analyzer results arrive as a list tagged with each analyzer's name
+    analyses = {analysis.get('analyzer'): analysis for analysis in event.get('analyses', [])}
+    r3_result = analyses.get('r3_engine', {}).get('Payload', {}).get('body', {})
+    arsm_result = analyses.get('arsm', {}).get('Payload', {}).get('body', {})
+    
+    return transaction_data, r3_result, arsm_result
+
+
+def build_result(model, transaction_data, r3_result, arsm_result, features, prediction, probability, request_id):
+    """Combine a prediction with its explanations and component scores"""
+    # Generate SHAP explanations
+    explanations = generate_shap_explanations(model, features)
+    
+    # Calculate final risk score
+    final_risk_score = calculate_final_risk_score(
+        r3_result.get('r3_risk_score', 0),
+        arsm_result.get('arsm_risk_score', 0),
+        probability
+    )
+    
+    return {
+        'transaction_id': transaction_data.get('id', 'unknown'),
+        'final_prediction': prediction,
+        'fraud_probability': probability,
+        'final_risk_score': final_risk_score,
+        'risk_category': get_risk_category(final_risk_score),
+        'explanations': explanations,
+        'model_features': dict(zip(FEATURE_ORDER, features.tolist())),
+        'component_scores': {
+            'r3_score': r3_result.get('r3_risk_score', 0),
+            'arsm_score': arsm_result.get('arsm_risk_score', 0),
+            'ml_score': probability
+        },
+        'timestamp': request_id
+    }
+
+
 def load_ml_model(s3_client):
-    """Load ML model from S3"""
+    """Load ML model from S3, reusing the model already loaded by this container"""
+    global _model
+    
+    if _model is not None:
+        return _model
+    
     try:
+        import joblib
+        
         model_bucket = os.environ['MODEL_BUCKET']
         model_key = 'models/tad_x_model.pkl'
         
@@ -98,14 +235,52 @@ def load_ml_model(s3_client):
         
         # Load model using joblib
         model = joblib.load(BytesIO(model_data))
+        
+        # LightGBM boosters are published separately in their native format
+        if model.get('booster_file'):
+            model['classifier'] = load_booster(s3_client, model_bucket, model['booster_file'])
+        
+        # The package names the Treelite-compiled library built from the same model
+        model['predictor'] = None
+        if model.get('compiled_model_file'):
+            model['predictor'] = load_compiled_predictor(s3_client, model_bucket, model['compiled_model_file'])
+        
+        model = prepare_model(model)
         print("Loaded model from S3")
         
+        _model = model
         return model
         
     except Exception as e:
         print(f"Could not load model from S3: {str(e)}")
-        # Return mock model for testing
-        return create_mock_model()
+        # Return mock model for testing; S3 is retried on the next invocation
+        return prepare_model(create_mock_model())
+
+
+def load_booster(s3_client, model_bucket, booster_file):
+    """Load a LightGBM booster saved next to the model package"""
+    import lightgbm as lgb
+    
+    response = s3_client.get_object(Bucket=model_bucket, Key=f"models/{booster_file}")
+    
+    return lgb.Booster(model_str=response['Body'].read().decode('utf-8'))
+
+
+def load_compiled_predictor(s3_client, model_bucket, compiled_model_file):
+    """Load the Treelite-compiled scorer published next to the model package"""
+    try:
+        import tl2cgen
+        
+        library_path = f"/tmp/{compiled_model_file}"
+        s3_client.download_file(model_bucket, f"models/{compiled_model_file}", library_path)
+        predictor = tl2cgen.Predictor(library_path)
+        print("Loaded compiled model from S3")
+        
+        return predictor
+        
+    except Exception as e:
+        print(f"Could not load compiled model: {str(e)}")
+        return None
 
 
 def create_mock_model():
@@ -133,27 +308,58 @@ def create_mock_model():
     return model
 
 
+def prepare_model(model):
+    """Attach the feature column mapping, input buffer and scaler arrays used by predict_fraud"""
+    n_features = len(model['feature_names'])
+    scaler = model.get('scaler')
+    
+    # Model columns filled from each prepare_features position; the rest stay 0
+    model_columns = [i for i, name in enumerate(model['feature_names']) if name in FEATURE_POSITIONS]
+    model['feature_target'] = np.array(model_columns, dtype=np.intp)
+    model['feature_source'] = np.array([FEATURE_POSITIONS[model['feature_names'][i]] for i in model_columns], dtype=np.intp)
+    model['feature_buffer'] = np.zeros((1, n_features), dtype=np.float64)
+    
+    # Tree models are trained without a scaler; an identity scaling keeps one code path
+    if scaler is None:
+        model['scaler_mean'] = np.zeros(n_features, dtype=np.float64)
+        model['scaler_scale'] = np.ones(n_features, dtype=np.float64)
+    else:
+        model['scaler_mean'] = np.ascontiguousarray(scaler.mean_ if scaler.with_mean else np.zeros(n_features), dtype=np.float64)
+        model['scaler_scale'] = np.ascontiguousarray(scaler.scale_ if scaler.with_std else np.ones(n_features), dtype=np.float64)
+    
+    return model
+
+
+def compiled_fraud_probabilities(predictor, rows):
+    """Score standardized feature rows with the compiled model"""
+    import tl2cgen
+    
+    output = np.asarray(predictor.predict(tl2cgen.DMatrix(rows)))
+    
+    # Classifiers return one column per class, boosters only the fraud probability
+    return output.reshape(rows.shape[0], -1)[:, -1]
+
+
 def prepare_features(transaction_data, r3_result, arsm_result):
-    """Prepare features for ML model"""
-    features = {}
+    """Prepare features for ML model, ordered as FEATURE_ORDER"""
+    graph_analysis = arsm_result.get('graph_analysis', {})
+    risk_metrics = arsm_result.get('risk_metrics', {})
+    
+    features = np.empty(len(FEATURE_ORDER), dtype=np.float64)
     
     # Transaction features
-    features['amount'] = float(transaction_data.get('amount', 0))
-    features['hour_of_day'] = int(transaction_data.get('timestamp', time.time())) % 86400 // 3600
+    features[0] = float(transaction_data.get('amount', 0))
+    features[1] = int(transaction_data.get('timestamp', time.time())) // 3600 % 24
     
     # R3 Engine features
-    features['r3_risk_score'] = float(r3_result.get('r3_risk_score', 0))
+    features[2] = float(r3_result.get('r3_risk_score', 0))
     
     # ARSM features
-    features['arsm_risk_score'] = float(arsm_result.get('arsm_risk_score', 0))
-    
-    graph_analysis = arsm_result.get('graph_analysis', {})
-    features['centrality'] = float(graph_analysis.get('centrality_score', 0))
-    features['clustering'] = float(graph_analysis.get('clustering_coefficient', 0))
-    
-    risk_metrics = arsm_result.get('risk_metrics', {})
-    features['velocity'] = float(risk_metrics.get('velocity', 0))
-    features['component_size'] = float(risk_metrics.get('component_size', 100))
+    features[3] = float(arsm_result.get('arsm_risk_score', 0))
+    features[4] = float(graph_analysis.get('centrality_score', 0))
+    features[5] = float(graph_analysis.get('clustering_coefficient', 0))
+    features[6] = float(risk_metrics.get('velocity', 0))
+    features[7] = float(risk_metrics.get('component_size', 100))
     
     return features
 
@@ -161,77 +367,128 @@ def prepare_features(transaction_data, r3_result, arsm_result):
 def predict_fraud(model, features):
     """Make fraud prediction using ML model"""
     try:
-        # Convert features to array
-        feature_array = np.array([
-            features.get(name, 0) for name in model['feature_names']
-        ]).reshape(1, -1)
+        # Fill the preallocated feature row in place
+        feature_buffer = model['feature_buffer']
+        feature_buffer.fill(0.0)
+        feature_buffer[0, model['feature_target']] = features[model['feature_source']]
         
-        # Scale features
-        feature_scaled = model['scaler'].transform(feature_array)
+        # Scale features in place
+        np.subtract(feature_buffer, model['scaler_mean'], out=feature_buffer)
+        np.divide(feature_buffer, model['scaler_scale'], out=feature_buffer)
         
-        # Make prediction
-        prediction = model['classifier'].predict(feature_scaled)[0]
-        probability = model['classifier'].predict_proba(feature_scaled)[0][1]
+        if model.get('predictor') is not None:
+            try:
+                probability = float(compiled_fraud_probabilities(model['predictor'], feature_buffer)[0])
+                return int(probability > 0.5), probability
+            except Exception as e:
+                print(f"Error in compiled prediction: {str(e)}")
+        
+        classifier = model['classifier']
+        
+        # LightGBM boosters return the fraud probability directly
+        if model.get('booster_file'):
+            probability = float(classifier.predict(feature_buffer)[0])
+            return int(probability > 0.5), probability
+        
+        # Make prediction from a single predict_proba pass
+        proba = classifier.predict_proba(feature_buffer)[0]
+        prediction = classifier.classes_[np.argmax(proba)]
+        probability = proba[1]
         
         return int(prediction), float(probability)
         
     except Exception as e:
         print(f"Error in prediction: {str(e)}")
-        # Fallback prediction based on simple rules
-        r3_score = features.get('r3_risk_score', 0)
-        arsm_score = features.get('arsm_risk_score', 0)
-        avg_score = (r3_score + arsm_score) / 2
+        return fallback_prediction(features)
+
+
+def predict_fraud_batch(model, features_list):
+    """Make fraud predictions for a batch of transactions in one pass"""
+    try:
+        # One row per transaction
+        feature_matrix = np.zeros((len(features_list), len(model['feature_names'])), dtype=np.float64)
+        feature_matrix[:, model['feature_target']] = np.vstack(features_list)[:, model['feature_source']]
+        
+        # Scale features in place
+        np.subtract(feature_matrix, model['scaler_mean'], out=feature_matrix)
+        np.divide(feature_matrix, model['scaler_scale'], out=feature_matrix)
+        
+        if model.get('predictor') is not None:
+            try:
+                probabilities = compiled_fraud_probabilities(model['predictor'], feature_matrix).tolist()
+                return [(int(probability > 0.5), probability) for probability in probabilities]
+            except Exception as e:
+                print(f"Error in compiled prediction: {str(e)}")
+        
+        classifier = model['classifier']
+        
+        # LightGBM boosters return the fraud probability directly
+        if model.get('booster_file'):
+            probabilities = classifier.predict(feature_matrix).tolist()
+            return [(int(probability > 0.5), probability) for probability in probabilities]
+        
+        # Make predictions from a single predict_proba pass
+        proba = classifier.predict_proba(feature_matrix)
+        predictions = classifier.classes_[np.argmax(proba, axis=1)]
         
-        prediction = 1 if avg_score > 0.5 else 0
-        probability = avg_score
+        return [(int(prediction), float(probability)) for prediction, probability in zip(predictions, proba[:, 1])]
         
-        return prediction, probability
+    except Exception as e:
+        print(f"Error in prediction: {str(e)}")
+        return [fallback_prediction(features) for features in features_list]
+
+
+def fallback_prediction(features):
+    """Fallback prediction based on simple rules"""
+    r3_score = float(features[FEATURE_POSITIONS['r3_risk_score']])
+    arsm_score = float(features[FEATURE_POSITIONS['arsm_risk_score']])
+    avg_score = (r3_score + arsm_score) / 2
+    
+    prediction = 1 if avg_score > 0.5 else 0
+    probability = avg_score
+    
+    return prediction, probability
 
 
 def generate_shap_explanations(model, features):
     """Generate SHAP explanations for the prediction"""
     try:
         # Simplified SHAP-like explanations
-        explanations = {}
-        
-        # Calculate feature importance based on values
-        total_score = sum(abs(features.get(name, 0)) for name in model['feature_names'])
-        
-        for feature_name in model['feature_names']:
-            value = features.get(feature_name, 0)
-            # Simplified importance calculation
-            importance = abs(value) / total_score if total_score > 0 else 0
-            
-            explanations[feature_name] = {
-                'value': value,
-                'importance': importance,
-                'impact': 'positive' if value > 0.5 else 'negative'
-            }
+        feature_names = model['feature_names']
+        model_values = np.zeros(len(feature_names), dtype=np.float64)
+        model_values[model['feature_target']] = features[model['feature_source']]
+        values = model_values.tolist()
         
-        # Sort by importance
-        sorted_explanations = dict(sorted(
-            explanations.items(), 
-            key=lambda x: x[1]['importance'], 
-            reverse=True
-        ))
+        # Importance is each feature's share of the total absolute value
+        abs_values = np.abs(model_values)
+        total_score = abs_values.sum()
+        importances = (abs_values / total_score if total_score > 0 else np.zeros_like(abs_values)).tolist()
         
-        return sorted_explanations
+        # Build the explanations once, sorted by importance; ties keep feature order
+        return {
+            feature_names[i]: {
+                'value': values[i],
+                'importance': importances[i],
+                'impact': 'positive' if values[i] > 0.5 else 'negative'
+            }
+            for i in np.argsort(-abs_values, kind='stable')
+        }
         
     except Exception as e:
         print(f"Error generating explanations: {str(e)}")
         return {
             'r3_risk_score': {
-                'value': features.get('r3_risk_score', 0),
+                'value': float(features[FEATURE_POSITIONS['r3_risk_score']]),
                 'importance': 0.3,
                 'impact': 'positive'
             },
             'arsm_risk_score': {
-                'value': features.get('arsm_risk_score', 0),
+                'value': float(features[FEATURE_POSITIONS['arsm_risk_score']]),
                 'importance': 0.3,
                 'impact': 'positive'
             },
             'amount': {
-                'value': features.get('amount', 0),
+                'value': float(features[FEATURE_POSITIONS['amount']]),
                 'importance': 0.2,
                 'impact': 'positive'
             }
@@ -269,21 +526,32 @@ def get_risk_category(risk_score):
         return 'MINIMAL'
 
 
-def store_results(results_table, result):
-    """Store results in DynamoDB"""
-    try:
-        results_table.put_item(
-            Item={
-                'transaction_id': result['transaction_id'],
-                'processed_timestamp': int(time.time()),
-                'prediction': result['final_prediction'],
-                'risk_score': result['final_risk_score'],
-                'risk_category': result['risk_category'],
-                'explanations': result['explanations'],
-                'component_scores': result['component_scores']
-            }
-        )
-        print("Results stored successfully")
-        
-    except Exception as e:
-        print(f"Error storing results: {str(e)}")
+def store_results_bulk(results_table, results):
+    """Store results in DynamoDB with BatchWriteItem; write errors are raised to the caller"""
+    processed_timestamp = int(time.time())
+    
+    # Duplicate keys within a batch are rejected, so later items replace earlier ones
+    with results_table.batch_writer(overwrite_by_pkeys=['transaction_id', 'processed_timestamp']) as batch:
+        for result in results:
+            batch.put_item(
+                Item=to_dynamodb({
+                    'transaction_id': result['transaction_id'],
+                    'processed_timestamp': processed_timestamp,
+                    'prediction': result['final_prediction'],
+                    'risk_score': result['final_risk_score'],
+                    'risk_category': result['risk_category'],
+                    'explanations': result['explanations'],
+                    'component_scores': result['component_scores']
+                })
+            )
+    print("Results stored successfully")
+
+
+def to_dynamodb(item):
+    """Convert an item's floats and numpy values to the Decimals DynamoDB requires"""
+    return json.loads(orjson.dumps(item, option=orjson.OPT_SERIALIZE_NUMPY), parse_float=Decimal)
+
+
+# Provisioned environments load the model during init, before any request arrives
+if os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency':
+    load_ml_model(s3)
@@ -4,15 +4,21 @@ Infrastructure resources for RAID-X
 
 import aws_cdk as cdk
 from aws_cdk import (
+    aws_dax as dax,
     aws_ec2 as ec2,
     aws_s3 as s3,
     aws_dynamodb as dynamodb,
     aws_iam as iam,
+    aws_sqs as sqs,
+    Duration,
     RemovalPolicy,
 )
 from aws_cdk.aws_neptune_alpha import (
     DatabaseCluster as NeptuneCluster,
+    EngineVersion as NeptuneEngineVersion,
     InstanceType as NeptuneInstanceType,
+    ParameterGroup as NeptuneParameterGroup,
+    ParameterGroupFamily as NeptuneParameterGroupFamily,
 )
 from constructs import Construct
 
@@ -30,7 +36,13 @@ class InfrastructureConstruct(Construct):
         self.data_bucket, self.model_bucket, self.logs_bucket = self._create_s3_buckets()
         
         # Create DynamoDB tables
-        self.config_table, self.metadata_table, self.results_table = self._create_dynamodb_tables()
+        self.config_table, self.metadata_table, self.results_table, self.address_metrics_table = self._create_dynamodb_tables()
+        
+        # Create DAX cluster in front of the config table
+        self.dax_cluster = self._create_dax_cluster()
+        
+        # Create SQS queues
+        self.etl_queue, self.tad_x_queue = self._create_queues()
         
         # Create Neptune cluster
         self.neptune_cluster = self._create_neptune_cluster()
@@ -55,7 +67,16 @@ class InfrastructureConstruct(Construct):
                     subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS,
                     cidr_mask=24
                 )
-            ]
+            ],
+            # Keep S3 and DynamoDB traffic from VPC-bound functions off the NAT gateway
+            gateway_endpoints={
+                "S3": ec2.GatewayVpcEndpointOptions(
+                    service=ec2.GatewayVpcEndpointAwsService.S3
+                ),
+                "DynamoDB": ec2.GatewayVpcEndpointOptions(
+                    service=ec2.GatewayVpcEndpointAwsService.DYNAMODB
+                )
+            }
         )
 
     def _create_s3_buckets(self):
@@ -138,7 +159,92 @@ class InfrastructureConstruct(Construct):
             removal_policy=RemovalPolicy.DESTROY
         )
         
-        return config_table, metadata_table, results_table
+        # Per-address graph metrics precomputed by the address metrics Glue job
+        address_metrics_table = dynamodb.Table(
+            self, "RaidXAddressMetricsTable",
+            table_name=f"raid-x-address-metrics-{self.environment_name}",
+            partition_key=dynamodb.Attribute(
+                name="address",
+                type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY
+        )
+        
+        return config_table, metadata_table, results_table, address_metrics_table
+
+    def _create_dax_cluster(self):
+        """Create DAX cluster for cached config table reads"""
+        dax_role = iam.Role(
+            self, "RaidXDaxRole",
+            assumed_by=iam.ServicePrincipal("dax.amazonaws.com")
+        )
+        self.config_table.grant_read_data(dax_role)
+        
+        dax_sg = ec2.SecurityGroup(
+            self, "DaxSecurityGroup",
+            vpc=self.vpc,
+            description="Security group for DAX cluster",
+            allow_all_outbound=True
+        )
+        
+        dax_sg.add_ingress_rule(
+            peer=ec2.Peer.ipv4(self.vpc.vpc_cidr_block),
+            connection=ec2.Port.tcp(8111),
+            description="DAX port"
+        )
+        
+        dax_subnet_group = dax.CfnSubnetGroup(
+            self, "DaxSubnetGroup",
+            subnet_group_name=f"raid-x-dax-{self.environment_name}",
+            description="Private subnets for the RAID-X DAX cluster",
+            subnet_ids=self.vpc.select_subnets(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS).subnet_ids
+        )
+        
+        return dax.CfnCluster(
+            self, "RaidXDaxCluster",
+            cluster_name=f"raid-x-dax-{self.environment_name}",
+            node_type="dax.t3.small",
+            replication_factor=1,
+            iam_role_arn=dax_role.role_arn,
+            subnet_group_name=dax_subnet_group.ref,
+            security_group_ids=[dax_sg.security_group_id],
+            sse_specification=dax.CfnCluster.SSESpecificationProperty(sse_enabled=True)
+        )
+
+    def _create_queues(self):
+        """Create SQS queues for ETL input and batched TAD-X scoring"""
+        etl_queue = sqs.Queue(
+            self, "RaidXEtlQueue",
+            queue_name=f"raid-x-etl-{self.environment_name}",
+            visibility_timeout=Duration.minutes(5),
+            retention_period=Duration.days(14),
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY
+        )
+        
+        # TAD-X messages that keep failing are set aside instead of being
+        # retried until they expire
+        tad_x_dlq = sqs.Queue(
+            self, "RaidXTadXDeadLetterQueue",
+            queue_name=f"raid-x-tad-x-dlq-{self.environment_name}",
+            retention_period=Duration.days(14),
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            removal_policy=RemovalPolicy.DESTROY
+        )
+        
+        # Visibility timeout must cover the TAD-X function timeout
+        tad_x_queue = sqs.Queue(
+            self, "RaidXTadXQueue",
+            queue_name=f"raid-x-tad-x-{self.environment_name}",
+            visibility_timeout=Duration.minutes(15),
+            retention_period=Duration.days(1),
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=3, queue=tad_x_dlq),
+            removal_policy=RemovalPolicy.DESTROY
+        )
+        
+        return etl_queue, tad_x_queue
 
     def _create_neptune_cluster(self):
         """Create Neptune cluster for graph database"""
@@ -155,10 +261,22 @@ class InfrastructureConstruct(Construct):
             description="Neptune port"
         )
         
+        # Enable the query results cache used by ARSM traversals
+        neptune_parameter_group = NeptuneParameterGroup(
+            self, "NeptuneParameterGroup",
+            description="RAID-X Neptune instance parameters",
+            family=NeptuneParameterGroupFamily.NEPTUNE_1_3,
+            parameters={
+                "neptune_result_cache": "1"
+            }
+        )
+        
         return NeptuneCluster(
             self, "RaidXNeptuneCluster",
             vpc=self.vpc,
             instance_type=NeptuneInstanceType.R5_LARGE,
+            engine_version=NeptuneEngineVersion.V1_3_0_0,
+            parameter_group=neptune_parameter_group,
             cluster_identifier=f"raid-x-neptune-{self.environment_name}",
             security_groups=[neptune_sg],
             iam_authentication=True,
@@ -180,12 +298,14 @@ class InfrastructureConstruct(Construct):
         # Add permissions for AWS services
         lambda_role.add_to_policy(iam.PolicyStatement(
             actions=[
-                "s3:GetObject", "s3:PutObject", "s3:DeleteObject",
-                "dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:UpdateItem", "dynamodb:Query", "dynamodb:Scan",
+                "s3:GetObject", "s3:PutObject", "s3:DeleteObject", "s3:ListBucket",
+                "dynamodb:GetItem", "dynamodb:BatchGetItem", "dynamodb:PutItem", "dynamodb:BatchWriteItem", "dynamodb:UpdateItem", "dynamodb:Query", "dynamodb:Scan",
                 "neptune-db:*",
                 "sagemaker:InvokeEndpoint",
                 "states:SendTaskSuccess", "states:SendTaskFailure",
-                "glue:StartJobRun", "glue:GetJobRun"
+                "glue:StartJobRun", "glue:GetJobRun",
+                "sqs:SendMessage", "sqs:ReceiveMessage", "sqs:DeleteMessage", "sqs:GetQueueAttributes",
+                "dax:GetItem", "dax:BatchGetItem", "dax:Query"
             ],
             resources=["*"]
         ))
@@ -223,4 +343,9 @@ class InfrastructureConstruct(Construct):
             resources=["*"]
         ))
         
+        glue_role.add_to_policy(iam.PolicyStatement(
+            actions=["dynamodb:DescribeTable", "dynamodb:BatchWriteItem", "dynamodb:PutItem"],
+            resources=[self.address_metrics_table.table_arn]
+        ))
+        
         return lambda_role, sagemaker_role, glue_role
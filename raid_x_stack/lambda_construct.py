@@ -5,7 +5,10 @@ Lambda functions for RAID-X
 import aws_cdk as cdk
 from aws_cdk import (
     Duration,
+    aws_events as events,
+    aws_events_targets as targets,
     aws_lambda as lambda_,
+    aws_lambda_event_sources as lambda_event_sources,
 )
 from constructs import Construct
 
@@ -23,17 +26,17 @@ class LambdaConstruct(Construct):
         functions = {}
         
         # R3 Engine Lambda
-        functions['r3_engine'] = lambda_.Function(
+        # Built as a container image so the DAX client and orjson are installed
+        functions['r3_engine'] = lambda_.DockerImageFunction(
             self, "R3EngineFunction",
-            runtime=lambda_.Runtime.PYTHON_3_11,
-            handler="main.handler",
-            code=lambda_.Code.from_asset("lambda_functions/r3_engine"),
+            code=lambda_.DockerImageCode.from_image_asset("lambda_functions/r3_engine"),
             role=self.infrastructure.lambda_role,
             vpc=self.infrastructure.vpc,
             timeout=Duration.minutes(5),
             memory_size=512,
             environment={
                 "CONFIG_TABLE": self.infrastructure.config_table.table_name,
+                "DAX_ENDPOINT": self.infrastructure.dax_cluster.attr_cluster_discovery_endpoint_url,
                 "ENVIRONMENT": self.environment_name
             }
         )
@@ -51,18 +54,17 @@ class LambdaConstruct(Construct):
             environment={
                 "NEPTUNE_ENDPOINT": self.infrastructure.neptune_cluster.cluster_endpoint.socket_address,
                 "METADATA_TABLE": self.infrastructure.metadata_table.table_name,
+                "ADDRESS_METRICS_TABLE": self.infrastructure.address_metrics_table.table_name,
                 "ENVIRONMENT": self.environment_name
             }
         )
         
         # TAD-X Lambda
-        functions['tad_x'] = lambda_.Function(
+        # Built as a container image; its dependencies exceed the zip package limit
+        functions['tad_x'] = lambda_.DockerImageFunction(
             self, "TADXFunction",
-            runtime=lambda_.Runtime.PYTHON_3_11,
-            handler="main.handler",
-            code=lambda_.Code.from_asset("lambda_functions/tad_x"),
+            code=lambda_.DockerImageCode.from_image_asset("lambda_functions/tad_x"),
             role=self.infrastructure.lambda_role,
-            vpc=self.infrastructure.vpc,
             timeout=Duration.minutes(10),
             memory_size=2048,
             environment={
@@ -72,6 +74,22 @@ class LambdaConstruct(Construct):
             }
         )
         
+        # Keep initialized TAD-X environments (model loaded) ready for the queue consumer
+        tad_x_live = lambda_.Alias(
+            self, "TADXLiveAlias",
+            alias_name="live",
+            version=functions['tad_x'].current_version,
+            provisioned_concurrent_executions=2
+        )
+        
+        # Score queued workflow tasks in batches
+        tad_x_live.add_event_source(lambda_event_sources.SqsEventSource(
+            self.infrastructure.tad_x_queue,
+            batch_size=25,
+            max_batching_window=Duration.seconds(1),
+            report_batch_item_failures=True
+        ))
+        
         # Data Ingestion Lambda
         functions['data_ingestion'] = lambda_.Function(
             self, "DataIngestionFunction",
@@ -79,16 +97,41 @@ class LambdaConstruct(Construct):
             handler="main.handler",
             code=lambda_.Code.from_asset("lambda_functions/data_ingestion"),
             role=self.infrastructure.lambda_role,
-            vpc=self.infrastructure.vpc,
             timeout=Duration.minutes(15),
             memory_size=1024,
             environment={
-                "DATA_BUCKET": self.infrastructure.data_bucket.bucket_name,
+                "ETL_QUEUE_URL": self.infrastructure.etl_queue.queue_url,
+                "ENVIRONMENT": self.environment_name
+            }
+        )
+        
+        # ETL Trigger Lambda
+        # Built as a container image for pyarrow
+        functions['etl_trigger'] = lambda_.DockerImageFunction(
+            self, "ETLTriggerFunction",
+            code=lambda_.DockerImageCode.from_image_asset("lambda_functions/etl_trigger"),
+            role=self.infrastructure.lambda_role,
+            # Drains for most of the schedule interval, inside the queue's visibility timeout
+            timeout=Duration.minutes(4),
+            memory_size=1024,
+            # Overlapping runs would submit the same pending batches twice
+            reserved_concurrent_executions=1,
+            environment={
+                "ETL_QUEUE_URL": self.infrastructure.etl_queue.queue_url,
                 "GLUE_JOB_NAME": f"raid-x-etl-{self.environment_name}",
+                "DATA_BUCKET": self.infrastructure.data_bucket.bucket_name,
+                "NEPTUNE_ENDPOINT": self.infrastructure.neptune_cluster.cluster_endpoint.hostname,
                 "ENVIRONMENT": self.environment_name
             }
         )
         
+        # Drain the ETL queue on a fixed schedule
+        events.Rule(
+            self, "ETLTriggerSchedule",
+            schedule=events.Schedule.rate(Duration.minutes(5)),
+            targets=[targets.LambdaFunction(functions['etl_trigger'])]
+        )
+        
         # Orchestrator Lambda
         functions['orchestrator'] = lambda_.Function(
             self, "OrchestratorFunction",
@@ -33,6 +33,7 @@ class RaidXStack(cdk.Stack):
         self.stepfunctions = StepFunctionsConstruct(
             self, "StepFunctions",
             lambda_functions=self.lambda_construct.functions,
+            tad_x_queue=self.infrastructure.tad_x_queue,
             environment_name=environment_name
         )
         
@@ -12,49 +12,85 @@ from constructs import Construct
 
 
 class StepFunctionsConstruct(Construct):
-    def __init__(self, scope: Construct, construct_id: str, lambda_functions: dict, environment_name: str, **kwargs):
+    def __init__(self, scope: Construct, construct_id: str, lambda_functions: dict, tad_x_queue, environment_name: str, **kwargs):
         super().__init__(scope, construct_id, **kwargs)
         
         self.lambda_functions = lambda_functions
+        self.tad_x_queue = tad_x_queue
         self.environment_name = environment_name
         self.state_machine = self._create_state_machine()
 
     def _create_state_machine(self):
         """Create Step Functions state machine for RAID-X pipeline"""
         
-        # Define Lambda invoke tasks
+        # Define Lambda invoke tasks; each analyzer records its name next to its result
         data_ingestion_task = tasks.LambdaInvoke(
             self, "DataIngestionTask",
             lambda_function=self.lambda_functions['data_ingestion'],
-            result_path="$.data_ingestion_result"
+            result_selector={"analyzer": "data_ingestion", "Payload.$": "$.Payload"}
         )
         
         r3_engine_task = tasks.LambdaInvoke(
             self, "R3EngineTask", 
             lambda_function=self.lambda_functions['r3_engine'],
-            result_path="$.r3_result"
+            result_selector={"analyzer": "r3_engine", "Payload.$": "$.Payload"}
         )
         
         arsm_task = tasks.LambdaInvoke(
             self, "ARSMTask",
             lambda_function=self.lambda_functions['arsm'],
-            result_path="$.arsm_result"
+            result_selector={"analyzer": "arsm", "Payload.$": "$.Payload"}
         )
         
-        tad_x_task = tasks.LambdaInvoke(
+        analyzer_tasks = {
+            'data_ingestion': data_ingestion_task,
+            'r3_engine': r3_engine_task,
+            'arsm': arsm_task
+        }
+        
+        # TAD-X scores queued tasks in batches and resumes each execution
+        # with its result
+        tad_x_task = tasks.SqsSendMessage(
             self, "TADXTask",
-            lambda_function=self.lambda_functions['tad_x'],
+            queue=self.tad_x_queue,
+            integration_pattern=sfn.IntegrationPattern.WAIT_FOR_TASK_TOKEN,
+            message_body=sfn.TaskInput.from_object({
+                "task_token": sfn.JsonPath.task_token,
+                "input": sfn.JsonPath.entire_payload
+            }),
+            task_timeout=sfn.Timeout.duration(Duration.minutes(15)),
             result_path="$.tad_x_result"
         )
         
-        # Define parallel processing for R3 and ARSM
-        parallel_analysis = sfn.Parallel(self, "ParallelAnalysis")
-        parallel_analysis.branch(r3_engine_task)
-        parallel_analysis.branch(arsm_task)
+        # Ingestion, R3 and ARSM all work from the submitted transaction.
+        # A Map state fans out one iteration per listed analyzer, all at
+        # once, so adding an analyzer only extends the list and the routing
+        select_analyzers = sfn.Pass(
+            self, "SelectAnalyzers",
+            result=sfn.Result.from_array(list(analyzer_tasks)),
+            result_path="$.analyzers"
+        )
+        
+        route_analyzer = sfn.Choice(self, "RouteAnalyzer")
+        for name, task in analyzer_tasks.items():
+            route_analyzer.when(sfn.Condition.string_equals("$.analyzer", name), task)
+        route_analyzer.otherwise(sfn.Fail(self, "UnknownAnalyzer", cause="No task for analyzer"))
+        
+        analyzer_map = sfn.Map(
+            self, "AnalyzersMap",
+            items_path="$.analyzers",
+            item_selector={
+                "analyzer.$": "$$.Map.Item.Value",
+                "transaction.$": "$.transaction"
+            },
+            max_concurrency=0,
+            result_path="$.analyses"
+        )
+        analyzer_map.item_processor(route_analyzer)
         
         # Create the workflow
-        definition = data_ingestion_task.next(
-            parallel_analysis.next(
+        definition = select_analyzers.next(
+            analyzer_map.next(
                 tad_x_task.next(
                     sfn.Succeed(self, "ProcessingComplete")
                 )
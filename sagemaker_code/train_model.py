@@ -3,17 +3,31 @@ SageMaker training script for fraud detection model
 """
 
 import argparse
+import hashlib
+import json
 import os
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
 import joblib
-from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
 from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import classification_report, roc_auc_score, confusion_matrix
+from sklearn.preprocessing import LabelEncoder
+from sklearn.metrics import roc_auc_score, confusion_matrix
+from threadpoolctl import threadpool_limits
 import lightgbm as lgb
+from numba import njit, prange
 import boto3
 
+# Model inputs, in training column order
+FEATURE_COLUMNS = [
+    'amount', 'amount_usd', 'hour_of_day', 'day_of_week',
+    'r3_risk_score', 'arsm_risk_score', 'centrality', 'clustering',
+    'velocity', 'component_size'
+]
+
 def parse_args():
     parser = argparse.ArgumentParser()
     
@@ -21,9 +35,14 @@ def parse_args():
     parser.add_argument('--model-dir', type=str, default=os.environ.get('SM_MODEL_DIR'))
     parser.add_argument('--train', type=str, default=os.environ.get('SM_CHANNEL_TRAIN'))
     parser.add_argument('--validation', type=str, default=os.environ.get('SM_CHANNEL_VALIDATION'))
+    parser.add_argument('--num-cpus', type=int, default=int(os.environ.get('SM_NUM_CPUS', os.cpu_count())))
+    parser.add_argument('--num-gpus', type=int, default=int(os.environ.get('SM_NUM_GPUS', '0')))
+    # Checkpoints are synced to S3 and shared by jobs that use the same checkpoint location
+    parser.add_argument('--dataset-cache-dir', type=str, default='/opt/ml/checkpoints' if os.path.isdir('/opt/ml/checkpoints') else None)
     
     # Hyperparameters
     parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--num-boost-round', type=int, default=2000)
     parser.add_argument('--max-depth', type=int, default=10)
     parser.add_argument('--learning-rate', type=float, default=0.1)
     parser.add_argument('--model-type', type=str, default='lightgbm', choices=['rf', 'gb', 'lightgbm'])
@@ -34,30 +53,34 @@ def load_data(train_path, validation_path=None):
     """Load training and validation data"""
     
     # Load training data
-    train_files = [f for f in os.listdir(train_path) if f.endswith('.csv')]
-    train_dfs = []
-    
-    for file in train_files:
-        df = pd.read_csv(os.path.join(train_path, file))
-        train_dfs.append(df)
-    
-    train_df = pd.concat(train_dfs, ignore_index=True)
+    train_df = read_csv_channel(train_path)
     
     # Load validation data if provided
     val_df = None
     if validation_path and os.path.exists(validation_path):
-        val_files = [f for f in os.listdir(validation_path) if f.endswith('.csv')]
-        val_dfs = []
-        
-        for file in val_files:
-            df = pd.read_csv(os.path.join(validation_path, file))
-            val_dfs.append(df)
-        
-        if val_dfs:
-            val_df = pd.concat(val_dfs, ignore_index=True)
+        val_df = read_csv_channel(validation_path)
     
     return train_df, val_df
 
+def read_csv_channel(path):
+    """Read the CSV files of a data channel into one DataFrame"""
+    
+    files = [entry.path for entry in os.scandir(path) if entry.name.endswith('.csv')]
+    if not files:
+        return None
+    
+    # Only the model columns are read, and the CSV reader parses the features
+    # straight to float32, so no float64 copy of the channel is made
+    csv_format = ds.CsvFileFormat(
+        convert_options=pacsv.ConvertOptions(
+            column_types={col: pa.float32() for col in FEATURE_COLUMNS}
+        )
+    )
+    dataset = ds.dataset(files, format=csv_format)
+    columns = [col for col in FEATURE_COLUMNS + ['is_fraud'] if col in dataset.schema.names]
+    
+    return dataset.to_table(columns=columns).to_pandas()
+
 def preprocess_data(df):
     """Preprocess the data for training"""
     
@@ -67,64 +90,115 @@ def preprocess_data(df):
         df = create_sample_data()
     
     # Feature engineering
-    feature_columns = [
-        'amount', 'amount_usd', 'hour_of_day', 'day_of_week',
-        'r3_risk_score', 'arsm_risk_score', 'centrality', 'clustering',
-        'velocity', 'component_size'
-    ]
-    
-    # Create missing columns with default values
-    for col in feature_columns:
-        if col not in df.columns:
+    feature_columns = FEATURE_COLUMNS
+    
+    # Create missing columns with default values, drawn as one matrix
+    existing = set(df.columns.tolist())
+    missing = [col for col in feature_columns if col not in existing]
+    if missing:
+        rng = np.random.default_rng(42)
+        synthetic = rng.random((len(df), len(missing)), dtype=np.float32)
+        
+        # Columns not uniform on [0, 1) are rescaled in place
+        for i, col in enumerate(missing):
             if col == 'amount':
-                df[col] = np.random.uniform(0.001, 100, len(df))
-            elif col in ['hour_of_day']:
-                df[col] = np.random.randint(0, 24, len(df))
-            elif col in ['day_of_week']:
-                df[col] = np.random.randint(0, 7, len(df))
-            else:
-                df[col] = np.random.uniform(0, 1, len(df))
+                synthetic[:, i] = synthetic[:, i] * (100 - 0.001) + 0.001
+            elif col == 'hour_of_day':
+                synthetic[:, i] = np.floor(synthetic[:, i] * 24)
+            elif col == 'day_of_week':
+                synthetic[:, i] = np.floor(synthetic[:, i] * 7)
+        
+        df = pd.concat([df, pd.DataFrame(synthetic, columns=missing, index=df.index)], axis=1)
     
     # Create target variable if not exists
     if 'is_fraud' not in df.columns:
         # Create synthetic fraud labels based on risk scores
-        fraud_probability = (
-            df.get('r3_risk_score', 0.3) * 0.3 +
-            df.get('arsm_risk_score', 0.3) * 0.3 +
-            (df.get('amount_usd', 1000) / 10000) * 0.2 +
-            np.random.uniform(0, 0.2, len(df))
+        labels = np.empty(len(df), dtype=np.int8)
+        synthesize_fraud_labels(
+            df['r3_risk_score'].to_numpy(dtype=np.float32),
+            df['arsm_risk_score'].to_numpy(dtype=np.float32),
+            df['amount_usd'].to_numpy(dtype=np.float32),
+            np.random.default_rng(42).random(len(df), dtype=np.float32),
+            labels
         )
-        df['is_fraud'] = (fraud_probability > 0.5).astype(int)
+        df['is_fraud'] = labels
     
     # Select features
-    X = df[feature_columns].fillna(0)
-    y = df['is_fraud']
+    X = np.nan_to_num(df[feature_columns].to_numpy(dtype=np.float32, copy=True), copy=False)
+    y = df['is_fraud'].to_numpy(dtype=np.int8)
     
     return X, y, feature_columns
 
+@njit(parallel=True, fastmath=True, cache=True)
+def synthesize_fraud_labels(r3_risk_score, arsm_risk_score, amount_usd, noise, out):
+    """Label each row from its risk scores, amount and uniform noise in one pass"""
+    for i in prange(out.shape[0]):
+        fraud_probability = (
+            r3_risk_score[i] * 0.3 +
+            arsm_risk_score[i] * 0.3 +
+            (amount_usd[i] / 10000) * 0.2 +
+            noise[i] * 0.2
+        )
+        out[i] = fraud_probability > 0.5
+
+@njit(cache=True)
+def confusion_counts(y_true, y_pred):
+    """Count true negatives, false positives, false negatives and true positives"""
+    tn = fp = fn = tp = 0
+    for i in range(y_true.shape[0]):
+        if y_true[i] == 1:
+            if y_pred[i] == 1:
+                tp += 1
+            else:
+                fn += 1
+        elif y_pred[i] == 1:
+            fp += 1
+        else:
+            tn += 1
+    
+    return tn, fp, fn, tp
+
+def classification_metrics(y_true, y_pred):
+    """Fraud-class precision, recall, F1 and accuracy from confusion counts taken in one pass"""
+    
+    tn, fp, fn, tp = confusion_counts(y_true, y_pred)
+    precision = tp / max(tp + fp, 1)
+    recall = tp / max(tp + fn, 1)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    
+    return {
+        'tn': tn, 'fp': fp, 'fn': fn, 'tp': tp,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'accuracy': (tp + tn) / len(y_pred)
+    }
+
 def create_sample_data(n_samples=10000):
     """Create sample training data"""
-    np.random.seed(42)
-    
-    data = {
-        'transaction_id': [f'tx_{i}' for i in range(n_samples)],
-        'amount': np.random.lognormal(0, 2, n_samples),
-        'hour_of_day': np.random.randint(0, 24, n_samples),
-        'day_of_week': np.random.randint(0, 7, n_samples),
-        'r3_risk_score': np.random.beta(2, 5, n_samples),
-        'arsm_risk_score': np.random.beta(2, 5, n_samples),
-        'centrality': np.random.beta(1, 10, n_samples),
-        'clustering': np.random.uniform(0, 1, n_samples),
-        'velocity': np.random.exponential(0.3, n_samples),
-        'component_size': np.random.lognormal(3, 1, n_samples)
-    }
-    
-    df = pd.DataFrame(data)
-    df['amount_usd'] = df['amount'] * 45000  # Assume BTC price
+    rng = np.random.default_rng(42)
+    
+    # One column-major float32 block; each column is drawn straight into place
+    samples = np.empty((n_samples, len(FEATURE_COLUMNS)), dtype=np.float32, order='F')
+    column = {name: samples[:, i] for i, name in enumerate(FEATURE_COLUMNS)}
+    
+    column['amount'][:] = rng.lognormal(0, 2, n_samples)
+    column['hour_of_day'][:] = rng.integers(0, 24, n_samples)
+    column['day_of_week'][:] = rng.integers(0, 7, n_samples)
+    column['r3_risk_score'][:] = rng.beta(2, 5, n_samples)
+    column['arsm_risk_score'][:] = rng.beta(2, 5, n_samples)
+    column['centrality'][:] = rng.beta(1, 10, n_samples)
+    rng.random(n_samples, dtype=np.float32, out=column['clustering'])
+    column['velocity'][:] = rng.exponential(0.3, n_samples)
+    column['component_size'][:] = rng.lognormal(3, 1, n_samples)
+    np.multiply(column['amount'], 45000, out=column['amount_usd'])  # Assume BTC price
+    
+    df = pd.DataFrame(samples, columns=FEATURE_COLUMNS, copy=False)
+    df.insert(0, 'transaction_id', np.char.add('tx_', np.arange(n_samples).astype('U16')))
     
     return df
 
-def train_model(X, y, args):
+def train_model(X, y, feature_names, args):
     """Train the fraud detection model"""
     
     # Split data
@@ -132,10 +206,8 @@ def train_model(X, y, args):
         X, y, test_size=0.2, random_state=42, stratify=y
     )
     
-    # Scale features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    # Tree ensembles are invariant to feature scaling, so no scaler is fit
+    scaler = None
     
     # Train model based on type
     if args.model_type == 'rf':
@@ -143,22 +215,41 @@ def train_model(X, y, args):
             n_estimators=args.n_estimators,
             max_depth=args.max_depth,
             random_state=42,
-            class_weight='balanced'
+            class_weight='balanced',
+            n_jobs=-1
         )
-        model.fit(X_train_scaled, y_train)
+        # Trees are built one per core; keep BLAS from adding threads of its own
+        with threadpool_limits(limits=1, user_api='blas'):
+            model.fit(X_train, y_train)
         
     elif args.model_type == 'gb':
-        model = GradientBoostingClassifier(
-            n_estimators=args.n_estimators,
+        # Histogram-based boosting builds each tree with all cores
+        model = HistGradientBoostingClassifier(
+            max_iter=args.n_estimators,
             max_depth=args.max_depth,
             learning_rate=args.learning_rate,
+            early_stopping=False,
             random_state=42
         )
-        model.fit(X_train_scaled, y_train)
+        model.fit(X_train, y_train)
         
     elif args.model_type == 'lightgbm':
-        train_data = lgb.Dataset(X_train_scaled, label=y_train)
-        valid_data = lgb.Dataset(X_test_scaled, label=y_test, reference=train_data)
+        # Early stopping watches a split of the training rows, so the test set stays unseen
+        X_fit, X_val, y_fit, y_val = train_test_split(
+            X_train, y_train, test_size=0.2, random_state=42, stratify=y_train
+        )
+        
+        # At most 63 bins per feature keeps histogram construction cheap
+        dataset_params = {
+            'max_bin': 63,
+            'min_data_in_bin': 3,
+            'feature_pre_filter': False
+        }
+        train_data, valid_data = build_lightgbm_datasets(X_fit, y_fit, X_val, y_val, dataset_params, args.dataset_cache_dir)
+        
+        # LightGBM has no class_weight; reweight the positive class from the fit split
+        n_pos = int((y_fit == 1).sum())
+        n_neg = len(y_fit) - n_pos
         
         params = {
             'objective': 'binary',
@@ -169,49 +260,160 @@ def train_model(X, y, args):
             'feature_fraction': 0.9,
             'bagging_fraction': 0.8,
             'bagging_freq': 5,
+            **dataset_params,
+            'num_threads': args.num_cpus,
             'verbose': 0,
-            'class_weight': 'balanced'
+            'scale_pos_weight': n_neg / max(n_pos, 1)
         }
         
-        model = lgb.train(
-            params,
-            train_data,
-            valid_sets=[valid_data],
-            num_boost_round=args.n_estimators,
-            callbacks=[lgb.early_stopping(50), lgb.log_evaluation(0)]
-        )
-    
-    # Evaluate model
+        # Build histograms in single precision on the GPU when the instance has one
+        if args.num_gpus > 0:
+            params.update({'device_type': 'cuda', 'gpu_use_dp': False})
+        
+        try:
+            model = train_lightgbm(params, train_data, valid_data, args)
+        except lgb.basic.LightGBMError as e:
+            # Stock LightGBM builds have no CUDA support
+            if params.get('device_type') != 'cuda':
+                raise
+            print(f"GPU training unavailable, falling back to CPU: {str(e)}")
+            params['device_type'] = 'cpu'
+            model = train_lightgbm(params, train_data, valid_data, args)
+    
+    # Evaluate model; labels are thresholded from the single probability pass
     if args.model_type in ['rf', 'gb']:
-        y_pred = model.predict(X_test_scaled)
-        y_pred_proba = model.predict_proba(X_test_scaled)[:, 1]
+        y_pred_proba = model.predict_proba(X_test)[:, 1]
     else:  # lightgbm
-        y_pred_proba = model.predict(X_test_scaled, num_iteration=model.best_iteration)
-        y_pred = (y_pred_proba > 0.5).astype(int)
+        y_pred_proba = model.predict(X_test, num_iteration=model.best_iteration)
+    y_pred = (y_pred_proba > 0.5).astype(np.int8)
     
     # Print evaluation metrics
     print("Model Evaluation:")
     print(f"AUC Score: {roc_auc_score(y_test, y_pred_proba):.4f}")
-    print(f"Classification Report:\n{classification_report(y_test, y_pred)}")
+    
+    metrics = classification_metrics(y_test, y_pred)
+    print(f"Confusion Matrix: TN={metrics['tn']} FP={metrics['fp']} FN={metrics['fn']} TP={metrics['tp']}")
+    print(f"Precision: {metrics['precision']:.4f} Recall: {metrics['recall']:.4f} F1: {metrics['f1']:.4f}")
+    print(f"Accuracy: {metrics['accuracy']:.4f}")
     
     # Create model package
     model_package = {
         'classifier': model,
         'scaler': scaler,
-        'feature_names': X.columns.tolist(),
+        'feature_names': feature_names,
         'model_type': args.model_type
     }
     
     return model_package
 
+def build_lightgbm_datasets(X_fit, y_fit, X_val, y_val, dataset_params, cache_dir=None):
+    """Build the LightGBM datasets, reusing binned copies cached by an earlier job on the same data"""
+    
+    if cache_dir:
+        # Cached files are keyed by the exact rows, labels and binning params
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (X_fit, y_fit, X_val, y_val):
+            digest.update(np.ascontiguousarray(part).tobytes())
+        digest.update(json.dumps(dataset_params, sort_keys=True).encode())
+        
+        train_path = os.path.join(cache_dir, f"lgb-train-{digest.hexdigest()}.bin")
+        valid_path = os.path.join(cache_dir, f"lgb-valid-{digest.hexdigest()}.bin")
+        
+        if os.path.exists(train_path) and os.path.exists(valid_path):
+            print(f"Reusing binned datasets from {cache_dir}")
+            train_data = lgb.Dataset(train_path, params=dataset_params)
+            valid_data = lgb.Dataset(valid_path, reference=train_data, params=dataset_params)
+            return train_data, valid_data
+    
+    # Binned from column-major copies so each feature's values are contiguous
+    train_data = lgb.Dataset(np.asfortranarray(X_fit), label=y_fit.astype(np.float32), params=dataset_params, free_raw_data=True)
+    valid_data = lgb.Dataset(np.asfortranarray(X_val), label=y_val.astype(np.float32), reference=train_data, params=dataset_params)
+    
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            train_data.construct().save_binary(train_path)
+            valid_data.construct().save_binary(valid_path)
+        except Exception as e:
+            print(f"Could not cache binned datasets: {str(e)}")
+    
+    return train_data, valid_data
+
+def train_lightgbm(params, train_data, valid_data, args):
+    """Train a LightGBM booster with early stopping on the validation set"""
+    
+    # The round limit is only a ceiling; early stopping ends training
+    evaluation = {}
+    model = lgb.train(
+        params,
+        train_data,
+        valid_sets=[valid_data],
+        num_boost_round=args.num_boost_round,
+        callbacks=[lgb.early_stopping(50), lgb.log_evaluation(0), lgb.record_evaluation(evaluation)]
+    )
+    
+    # The returned booster is cut back to its best iteration, so the round
+    # boosting actually stopped at comes from the evaluation record
+    rounds = len(next(iter(evaluation['valid_0'].values())))
+    print(f"Boosting stopped after {rounds} rounds, best iteration {model.best_iteration}")
+    
+    return model
+
 def save_model(model_package, model_dir):
     """Save the trained model"""
     
+    model_package = dict(model_package)
+    
+    # LightGBM boosters are saved in their native format, referenced from the package
+    if model_package['model_type'] == 'lightgbm':
+        booster_path = os.path.join(model_dir, 'tad_x_model.txt')
+        model_package['classifier'].save_model(booster_path)
+        model_package['classifier'] = None
+        model_package['booster_file'] = os.path.basename(booster_path)
+        print(f"Booster saved to {booster_path}")
+    
     model_path = os.path.join(model_dir, 'tad_x_model.pkl')
-    joblib.dump(model_package, model_path)
+    joblib.dump(model_package, model_path, compress=('lz4', 3), protocol=5)
     
     print(f"Model saved to {model_path}")
 
+def compile_model(model_package, model_dir):
+    """Compile the trained trees into a shared library for TAD-X scoring
+    
+    Compilation needs Treelite, TL2cgen and gcc on the training image. It is
+    best-effort: on failure the model is saved without a compiled library and
+    TAD-X falls back to the library predictor.
+    """
+    
+    try:
+        import treelite
+        import tl2cgen
+        
+        classifier = model_package['classifier']
+        
+        if model_package['model_type'] == 'lightgbm':
+            compiled = treelite.frontend.from_lightgbm(classifier)
+        else:
+            compiled = treelite.sklearn.import_model(classifier)
+        
+        # Inputs are scored unscaled, as in training
+        build_path = os.path.join(model_dir, 'tad_x_model.so')
+        tl2cgen.export_lib(compiled, toolchain='gcc', libpath=build_path)
+    except Exception as e:
+        print(f"WARNING: Model compilation failed, TAD-X will use the uncompiled model: {str(e)}")
+        return None
+    
+    # The library is named after its contents and referenced from the model
+    # package, so TAD-X never pairs a package with another model's library
+    with open(build_path, 'rb') as f:
+        digest = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+    library_path = os.path.join(model_dir, f'tad_x_model-{digest}.so')
+    os.replace(build_path, library_path)
+    
+    print(f"Compiled model saved to {library_path}")
+    
+    return os.path.basename(library_path)
+
 def main():
     args = parse_args()
     
@@ -228,7 +430,10 @@ def main():
     print(f"Fraud rate: {y.mean():.4f}")
     
     # Train model
-    model_package = train_model(X, y, args)
+    model_package = train_model(X, y, feature_names, args)
+    
+    # Compile before saving so the package names its compiled library
+    model_package['compiled_model_file'] = compile_model(model_package, args.model_dir)
     
     # Save model
     save_model(model_package, args.model_dir)
@@ -3,8 +3,39 @@ Basic tests for RAID-X framework
 """
 
 import pytest
+import importlib.util
 import json
 import os
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+def load_module(name, *path):
+    """Import a component's source file as a module"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT_DIR, *path))
+    module = importlib.util.module_from_spec(spec)
+    # Numba's on-disk cache resolves compiled functions by module name
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def load_tad_x():
+    """Import the TAD-X handler module with the environment it expects"""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('RESULTS_TABLE', 'raid-x-results-test')
+    return load_module('tad_x_main', 'lambda_functions', 'tad_x', 'main.py')
+
+def fit_forest(tad_x):
+    """Fit a small random forest on TAD-X's feature order and return it with held-out rows"""
+    np = pytest.importorskip('numpy')
+    ensemble = pytest.importorskip('sklearn.ensemble')
+    
+    rng = np.random.default_rng(0)
+    X = rng.random((400, len(tad_x.FEATURE_ORDER)))
+    y = (X[:, 2] + X[:, 3] + rng.normal(0, 0.2, 400) > 1).astype(int)
+    classifier = ensemble.RandomForestClassifier(n_estimators=15, max_depth=6, random_state=0).fit(X, y)
+    
+    return classifier, rng.random((50, len(tad_x.FEATURE_ORDER)))
 
 def test_config_loading():
     """Test configuration file loading"""
@@ -24,14 +55,16 @@ def test_lambda_functions_exist():
     """Test that all Lambda function directories exist"""
     lambda_dir = os.path.join(os.path.dirname(__file__), '..', 'lambda_functions')
     
-    expected_functions = ['r3_engine', 'arsm', 'tad_x', 'data_ingestion', 'orchestrator']
+    expected_functions = ['r3_engine', 'arsm', 'tad_x', 'data_ingestion', 'orchestrator', 'etl_trigger']
+    
+    # One directory scan per level instead of a stat per path
+    entries = {entry.name: entry for entry in os.scandir(lambda_dir)}
     
     for func in expected_functions:
-        func_dir = os.path.join(lambda_dir, func)
-        assert os.path.exists(func_dir), f"Lambda function directory {func} should exist"
+        assert func in entries and entries[func].is_dir(), f"Lambda function directory {func} should exist"
         
-        main_file = os.path.join(func_dir, 'main.py')
-        assert os.path.exists(main_file), f"Main file for {func} should exist"
+        func_files = {entry.name for entry in os.scandir(entries[func].path) if entry.is_file()}
+        assert 'main.py' in func_files, f"Main file for {func} should exist"
 
 def test_stack_files_exist():
     """Test that all stack files exist"""
@@ -45,9 +78,64 @@ def test_stack_files_exist():
         'api_construct.py'
     ]
     
+    entries = {entry.name for entry in os.scandir(stack_dir)}
+    
     for file in expected_files:
-        file_path = os.path.join(stack_dir, file)
-        assert os.path.exists(file_path), f"Stack file {file} should exist"
+        assert file in entries, f"Stack file {file} should exist"
+
+def test_library_predictor_matches_predict_proba():
+    """Test that models without a compiled library are scored by the classifier itself"""
+    tad_x = load_tad_x()
+    classifier, rows = fit_forest(tad_x)
+    
+    model = tad_x.prepare_model({
+        'classifier': classifier,
+        'scaler': None,
+        'feature_names': list(tad_x.FEATURE_ORDER),
+        'predictor': None
+    })
+    
+    expected = classifier.predict_proba(rows)[:, 1]
+    
+    probabilities = [probability for _, probability in tad_x.predict_fraud_batch(model, list(rows))]
+    assert probabilities == pytest.approx(expected.tolist(), abs=1e-12)
+    
+    # The single-transaction path reports the same probability
+    _, probability = tad_x.predict_fraud(model, rows[0])
+    assert probability == pytest.approx(expected[0], abs=1e-12)
+
+def test_compiled_model_matches_predict_proba(tmp_path):
+    """Test that the Treelite-compiled scorer reproduces the forest's fraud probabilities"""
+    pytest.importorskip('treelite')
+    tl2cgen = pytest.importorskip('tl2cgen')
+    train_model = load_module('train_model', 'sagemaker_code', 'train_model.py')
+    tad_x = load_tad_x()
+    classifier, rows = fit_forest(tad_x)
+    
+    compiled_model_file = train_model.compile_model({'classifier': classifier, 'model_type': 'rf'}, str(tmp_path))
+    predictor = tl2cgen.Predictor(str(tmp_path / compiled_model_file))
+    
+    expected = classifier.predict_proba(rows)[:, 1]
+    assert tad_x.compiled_fraud_probabilities(predictor, rows).tolist() == pytest.approx(expected.tolist(), abs=1e-6)
+
+def test_classification_metrics_match_sklearn():
+    """Test that the confusion-count metrics agree with scikit-learn"""
+    np = pytest.importorskip('numpy')
+    metrics = pytest.importorskip('sklearn.metrics')
+    train_model = load_module('train_model', 'sagemaker_code', 'train_model.py')
+    
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 2, 1000).astype(np.int8)
+    y_pred = np.where(rng.random(1000) < 0.8, y_true, 1 - y_true).astype(np.int8)
+    
+    result = train_model.classification_metrics(y_true, y_pred)
+    
+    tn, fp, fn, tp = metrics.confusion_matrix(y_true, y_pred).ravel()
+    assert (result['tn'], result['fp'], result['fn'], result['tp']) == (tn, fp, fn, tp)
+    assert result['precision'] == pytest.approx(metrics.precision_score(y_true, y_pred))
+    assert result['recall'] == pytest.approx(metrics.recall_score(y_true, y_pred))
+    assert result['f1'] == pytest.approx(metrics.f1_score(y_true, y_pred))
+    assert result['accuracy'] == pytest.approx(metrics.accuracy_score(y_true, y_pred))
 
 if __name__ == '__main__':
     pytest.main([__file__])